@@ -1,5 +1,7 @@
 class AssetNetworkResponse(object):
 
+    __slots__ = ('_date', '_net_asset_value')
+
     def __init__(self, date, net_asset_value):
         # 资产日期
         self._date = date
@@ -0,0 +1,123 @@
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from base.clazz.asset_network_response import AssetNetworkResponse
+
+
+class AssetNetworkSeries(object):
+    """
+    资产净值序列, 用两个连续数组保存日期和单位净值, 代替 AssetNetworkResponse 列表
+
+    按下标取值时返回 AssetNetworkResponse, 切片时返回共享底层数组的 AssetNetworkSeries,
+    迭代、len、切片的用法和 AssetNetworkResponse 列表一致。
+    """
+
+    __slots__ = ('_dates', '_net_asset_values')
+
+    def __init__(self, dates, net_asset_values):
+        # 资产日期, datetime64[D] 数组
+        self._dates = np.asarray(dates, dtype='datetime64[D]')
+        # 单位净值, float64 数组
+        self._net_asset_values = np.asarray(net_asset_values, dtype=np.float64)
+        if self._dates.shape != self._net_asset_values.shape or self._dates.ndim != 1:
+            raise ValueError(f"dates {self._dates.shape} and net_asset_values {self._net_asset_values.shape} "
+                             f"must be 1-D arrays of the same length")
+
+    @classmethod
+    def from_responses(cls, responses: Iterable[AssetNetworkResponse]) -> 'AssetNetworkSeries':
+        """
+        从 AssetNetworkResponse 列表创建序列
+
+        Args:
+            responses: AssetNetworkResponse 对象列表
+
+        Returns:
+            资产净值序列
+        """
+        responses = list(responses)
+        return cls([response.date for response in responses],
+                   [response.net_asset_value for response in responses])
+
+    @classmethod
+    def concatenate(cls, series_list: Iterable['AssetNetworkSeries']) -> 'AssetNetworkSeries':
+        """
+        按顺序拼接多个序列
+
+        Args:
+            series_list: 序列列表
+
+        Returns:
+            拼接后的新序列
+        """
+        series_list = list(series_list)
+        if not series_list:
+            return cls([], [])
+        return cls(np.concatenate([series.dates for series in series_list]),
+                   np.concatenate([series.net_asset_values for series in series_list]))
+
+    @property
+    def dates(self) -> np.ndarray:
+        return self._dates
+
+    @property
+    def net_asset_values(self) -> np.ndarray:
+        return self._net_asset_values
+
+    def date_strings(self) -> List[str]:
+        """
+        获取 yyyy-mm-dd 格式的日期列表
+
+        Returns:
+            日期字符串列表
+        """
+        return np.datetime_as_string(self._dates, unit='D').tolist()
+
+    def sort_by_date(self, reverse: bool = False) -> 'AssetNetworkSeries':
+        """
+        按照日期排序
+
+        Args:
+            reverse: 是否倒序, 接口返回的数据为倒序
+
+        Returns:
+            排序后的新序列
+        """
+        order = np.argsort(self._dates, kind='stable')
+        if reverse:
+            order = order[::-1]
+        return AssetNetworkSeries(self._dates[order], self._net_asset_values[order])
+
+    def to_numpy(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        转为 numpy 数组, 不复制数据
+
+        Returns:
+            (日期数组, 单位净值数组)
+        """
+        return self._dates, self._net_asset_values
+
+    def to_pandas(self):
+        """
+        转为以日期为索引的 pandas.Series, 单位净值不复制数据
+
+        Returns:
+            pandas.Series
+        """
+        import pandas as pd
+        return pd.Series(self._net_asset_values, index=pd.DatetimeIndex(self._dates), copy=False)
+
+    def __len__(self) -> int:
+        return len(self._net_asset_values)
+
+    def __iter__(self) -> Iterator[AssetNetworkResponse]:
+        for date, net_asset_value in zip(self.date_strings(), self._net_asset_values.tolist()):
+            yield AssetNetworkResponse(date=date, net_asset_value=net_asset_value)
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]) -> Union[AssetNetworkResponse, 'AssetNetworkSeries']:
+        if isinstance(index, (slice, np.ndarray)):
+            return AssetNetworkSeries(self._dates[index], self._net_asset_values[index])
+        return AssetNetworkResponse(date=str(self._dates[index]), net_asset_value=self._net_asset_values[index].item())
+
+    def __repr__(self) -> str:
+        return f"AssetNetworkSeries(len={len(self)})"
@@ -1,37 +1,62 @@
+import argparse
+import fnmatch
 import os
 import codecs
-import chardet
-from typing import Any
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
 
+# 检测编码时最多读取的字节数
+DETECT_SAMPLE_SIZE = 256 * 1024
+# 检测编码时每次读取的字节数, 检测结果确定后不再继续读取
+DETECT_CHUNK_SIZE = 16 * 1024
+# 转换编码时每次读取的字节数
+CONVERT_CHUNK_SIZE = 1024 * 1024
+# chardet 把 GBK 文件识别为 GB2312, 按照兼容 GB2312 和 GBK 的 GB18030 解码, 避免 GBK 扩展的汉字被替换
+DECODE_ENCODING_DICT = {"gb2312": "gb18030", "gbk": "gb18030"}
+# 转换后的文件名后缀, a.txt 转换后为 a_converted.txt
+CONVERTED_SUFFIX = "_converted"
+# 批量转换时每次提交给一个进程的文件数, 减少小文件的进程间通信开销
+CONVERT_BATCH_CHUNK_SIZE = 16
 
-def convert_file_encoding(file_path: str, target_encoding: str) -> Any:
+
+def convert_file_encoding(file_path: str, target_encoding: str, original_encoding: Optional[str] = None) -> Any:
     """
     转换文件编码并将结果保存到新文件
 
+    按块流式读取、解码、编码和写入, 内存占用和文件大小无关。先写入临时文件, 转换失败时不会留下不完整的新文件
+
     Args:
         file_path: 源文件路径
         target_encoding: 目标编码
+        original_encoding: 源文件编码, 为 None 时自动检测
 
     Returns:
         新文件的路径，如果转换失败则返回 None
     """
     try:
-        original_encoding = detect_encoding(file_path)["encoding"]
+        if original_encoding is None:
+            original_encoding = detect_encoding(file_path)["encoding"]
+        original_encoding = DECODE_ENCODING_DICT.get(original_encoding.lower(), original_encoding)
 
         # 构建新文件名
-        base_name, ext = os.path.splitext(file_path)
-        new_file_path = f"{base_name}_converted{ext}"
-
-        # 使用 codecs 模块以处理各种编码
-        with codecs.open(file_path, 'r', encoding=original_encoding, errors='replace') as source_file:
-            try:
-                content = source_file.read()
-            except UnicodeDecodeError as e:
-                print(f"解码错误：{e}")
-                return None
+        new_file_path = get_converted_file_path(file_path)
 
-        with codecs.open(new_file_path, 'w', encoding=target_encoding) as target_file:
-            target_file.write(content)
+        # 增量编解码器会保存跨块的半个多字节字符, 不需要关心块的边界
+        decoder = codecs.getincrementaldecoder(original_encoding)(errors='replace')
+        encoder = codecs.getincrementalencoder(target_encoding)()
+        temp_path = f"{new_file_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(file_path, 'rb') as source_file, open(temp_path, 'wb') as target_file:
+                for chunk in iter(lambda: source_file.read(CONVERT_CHUNK_SIZE), b''):
+                    target_file.write(encoder.encode(decoder.decode(chunk)))
+                target_file.write(encoder.encode(decoder.decode(b'', final=True), final=True))
+            os.replace(temp_path, new_file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
         return new_file_path
     except FileNotFoundError:
@@ -42,24 +67,258 @@ def convert_file_encoding(file_path: str, target_encoding: str) -> Any:
         return None
 
 
-def detect_encoding(file_path: str) -> Any:
+def get_converted_file_path(file_path: str) -> str:
+    """
+    获取转换编码后的文件路径
+
+    Args:
+        file_path: 源文件路径
+
+    Returns:
+        新文件路径, 例如 a.txt 为 a_converted.txt
+    """
+    base_name, ext = os.path.splitext(file_path)
+    return f"{base_name}{CONVERTED_SUFFIX}{ext}"
+
+
+def is_same_encoding(detected_encoding: Optional[str], target_encoding: str) -> bool:
+    """
+    判断检测到的编码是否已经是目标编码, 不需要转换
+
+    ASCII 文件在所有兼容 ASCII 的编码(例如 utf-8, gbk)下内容都相同, 视为已经是目标编码
+
+    Args:
+        detected_encoding: 检测到的编码
+        target_encoding: 目标编码
+
+    Returns:
+        是否相同
+    """
+    if not detected_encoding:
+        return False
+    try:
+        detected_name = codecs.lookup(detected_encoding).name
+        target_name = codecs.lookup(target_encoding).name
+    except LookupError:
+        return False
+    if detected_name == target_name:
+        return True
+    ascii_bytes = bytes(range(128))
+    return detected_name == "ascii" and ascii_bytes.decode("ascii").encode(target_name) == ascii_bytes
+
+
+def list_files_to_convert(root: str, patterns: Iterable[str] = ("*",)) -> Tuple[List[str], List[str]]:
+    """
+    查找目录下需要转换编码的文件
+
+    跳过同一批中其他文件的转换结果, 例如同时有 a.txt 和 a_converted.txt 时只转换 a.txt,
+    只有 a_converted.txt 时它是源文件, 需要转换。转换结果比源文件新的文件视为已经转换过
+
+    Args:
+        root: 目录
+        patterns: 文件名的通配符, 例如 *.txt, 匹配任意一个即可
+
+    Returns:
+        (需要转换的文件列表, 已经转换过的文件列表)
+    """
+    patterns = list(patterns)
+    file_path_list = []
+    up_to_date_list = []
+    for folder, _, file_name_list in os.walk(root):
+        matched_path_list = [os.path.join(folder, file_name) for file_name in sorted(file_name_list)
+                             if any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns)]
+        # 转换结果和源文件在同一个目录
+        converted_path_set = {get_converted_file_path(file_path) for file_path in matched_path_list}
+        for file_path in matched_path_list:
+            if file_path in converted_path_set:
+                continue
+            converted_file_path = get_converted_file_path(file_path)
+            if os.path.exists(converted_file_path) \
+                    and os.path.getmtime(converted_file_path) >= os.path.getmtime(file_path):
+                up_to_date_list.append(file_path)
+            else:
+                file_path_list.append(file_path)
+    return file_path_list, up_to_date_list
+
+
+def convert_directory_encoding(root: str, target_encoding: str, patterns: Iterable[str] = ("*",),
+                               max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    批量转换目录下文件的编码, 多个进程同时转换, 结束后打印统计信息
+
+    已经是目标编码的文件, 以及转换结果比源文件新的文件不会重复转换
+
+    Args:
+        root: 目录
+        target_encoding: 目标编码
+        patterns: 文件名的通配符, 例如 *.txt, 匹配任意一个即可
+        max_workers: 最大进程数, 默认为 CPU 核数, 为 1 时在当前进程转换
+
+    Returns:
+        converted(转换成功的文件), skipped(已经是目标编码的文件), up_to_date(已经转换过的文件),
+        failed((文件, 原因) 列表), bytes(转换的源文件字节数), seconds(耗时)
+    """
+    codecs.lookup(target_encoding)
+    start_time = time.perf_counter()
+
+    file_path_list, up_to_date_list = list_files_to_convert(root, patterns)
+    result = {"converted": [], "skipped": [], "up_to_date": up_to_date_list, "failed": [], "bytes": 0}
+    if max_workers == 1 or len(file_path_list) <= 1:
+        status_list = map(_convert_one_file, file_path_list, repeat(target_encoding))
+        _collect_convert_status(result, status_list)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            _collect_convert_status(result, executor.map(_convert_one_file, file_path_list, repeat(target_encoding),
+                                                         chunksize=CONVERT_BATCH_CHUNK_SIZE))
+    result["seconds"] = time.perf_counter() - start_time
+
+    speed = result["bytes"] / result["seconds"] if result["seconds"] > 0 else 0
+    print(f"转换 {len(result['converted'])} 个文件, 跳过 {len(result['skipped'])} 个已经是 {target_encoding} 的文件"
+          f"和 {len(up_to_date_list)} 个已经转换过的文件, 失败 {len(result['failed'])} 个; "
+          f"{result['bytes']} 字节, 耗时 {result['seconds']:.2f} 秒, {speed / 1024 / 1024:.2f} MB/s")
+    for file_path, reason in result["failed"]:
+        print(f"  转换失败 {file_path}: {reason}")
+    return result
+
+
+def _convert_one_file(file_path: str, target_encoding: str) -> Tuple[str, str, int, str]:
+    """在进程池中转换一个文件, 返回 (文件路径, converted / skipped / failed, 文件大小, 说明)"""
+    if os.path.getsize(file_path) == 0:
+        # 空文件在任何编码下都相同
+        return file_path, "skipped", 0, "empty"
+    detect_result = detect_encoding(file_path)
+    if detect_result is None:
+        return file_path, "failed", 0, "检测编码失败"
+    detected_encoding = detect_result["encoding"]
+    if is_same_encoding(detected_encoding, target_encoding):
+        return file_path, "skipped", 0, detected_encoding
+    if not detected_encoding:
+        return file_path, "failed", 0, "无法识别编码"
+    if convert_file_encoding(file_path, target_encoding, detected_encoding) is None:
+        return file_path, "failed", 0, f"从 {detected_encoding} 转换失败"
+    return file_path, "converted", os.path.getsize(file_path), detected_encoding
+
+
+def _collect_convert_status(result: Dict[str, Any], status_list: Iterable[Tuple[str, str, int, str]]) -> None:
+    for file_path, status, size, message in status_list:
+        if status == "failed":
+            result["failed"].append((file_path, message))
+        else:
+            result[status].append(file_path)
+            result["bytes"] += size
+
+
+def write_text_atomically(file_path: str, content: str, encoding: str = "utf-8") -> None:
+    """
+    原子地写入文本文件
+
+    先写入同一目录下的临时文件再替换目标文件, 写入中途退出时不会留下只写了一半的文件
+
+    Args:
+        file_path: 文件路径
+        content: 文件内容
+        encoding: 文件编码
+    """
+    _write_atomically(file_path, content, 'w', encoding)
+
+
+def write_bytes_atomically(file_path: str, content: bytes) -> None:
+    """
+    原子地写入二进制文件, 同 write_text_atomically
+
+    Args:
+        file_path: 文件路径
+        content: 文件内容
+    """
+    _write_atomically(file_path, content, 'wb', None)
+
+
+def _write_atomically(file_path: str, content: Any, mode: str, encoding: Optional[str]) -> None:
+    # 临时文件和目标文件在同一目录, 保证 os.replace 是同一文件系统内的重命名
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, mode, encoding=encoding) as f:
+            f.write(content)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def detect_encoding(file_path: str, sample_size: int = DETECT_SAMPLE_SIZE) -> Any:
     """
     检测文件编码
 
+    使用 chardet 的增量检测, 最多读取 sample_size 字节, 检测结果确定后提前结束。
+    开头的采样全部为 ASCII 时继续向后查找第一段非 ASCII 内容重新检测, 避免把后面的中文当作 ASCII
+
     Args:
         file_path: 文件路径
+        sample_size: 最多用于检测的字节数
 
     Returns:
         检测到的编码信息字典，如果发生错误则返回 None
     """
+    # chardet 导入较慢, 只在需要检测编码时导入
+    from chardet.universaldetector import UniversalDetector
+
     try:
         with open(file_path, 'rb') as f:  # 以二进制模式读取文件
-            rawdata = f.read()
-            result = chardet.detect(rawdata)
-            return result
+            detector = UniversalDetector()
+            _feed_detector(detector, f.read(DETECT_CHUNK_SIZE), f, sample_size)
+            if detector.result["encoding"] != "ascii":
+                return detector.result
+
+            # 找到第一段包含非 ASCII 字符的内容, 从该位置重新检测, 全部为 ASCII 时即为 ASCII
+            for chunk in iter(lambda: f.read(DETECT_CHUNK_SIZE), b''):
+                if not chunk.isascii():
+                    start = next(index for index, byte in enumerate(chunk) if byte >= 0x80)
+                    detector = UniversalDetector()
+                    _feed_detector(detector, chunk[start:], f, sample_size)
+                    break
+            return detector.result
     except FileNotFoundError:
         print(f"文件未找到：{file_path}")
         return None
     except Exception as e:
         print(f"检测编码时发生错误：{e}")
         return None
+
+
+def _feed_detector(detector: Any, first_chunk: bytes, file: BinaryIO, sample_size: int) -> None:
+    """从 first_chunk 开始按块检测, 直到检测结果确定或者读取了 sample_size 字节"""
+    detector.feed(first_chunk)
+    read_size = len(first_chunk)
+    while read_size < sample_size and not detector.done:
+        chunk = file.read(DETECT_CHUNK_SIZE)
+        if not chunk:
+            break
+        detector.feed(chunk)
+        read_size += len(chunk)
+    detector.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    命令行入口, 转换一个文件或者目录下所有文件的编码
+
+    Args:
+        argv: 命令行参数, 默认为 sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(prog="python -m base.lcn_file", description="转换文件编码, 结果保存为 *_converted 文件")
+    parser.add_argument("path", help="文件或者目录")
+    parser.add_argument("-t", "--target_encoding", default="utf-8", help="目标编码, 默认为 utf-8")
+    parser.add_argument("-p", "--pattern", dest="patterns", action="append",
+                        help="目录下文件名的通配符, 可以指定多个, 默认为所有文件")
+    parser.add_argument("-j", "--max_workers", type=int, default=None, help="最大进程数, 默认为 CPU 核数")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.path):
+        convert_directory_encoding(args.path, args.target_encoding, args.patterns or ["*"], args.max_workers)
+    else:
+        print(convert_file_encoding(args.path, args.target_encoding))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import random
+import threading
+import time
+from contextlib import nullcontext
+from typing import ContextManager, Dict, Optional, TYPE_CHECKING
+from urllib.parse import urlparse
+
+# requests 导入较慢, 在第一次请求时再导入
+if TYPE_CHECKING:
+    import requests
+
+# 默认的请求超时时间, 单位秒
+DEFAULT_TIMEOUT = 10
+# 默认的最大重试次数, 不包括第一次请求
+DEFAULT_MAX_RETRIES = 3
+# 默认重试的请求方法, 其他方法重复发送可能产生副作用, 例如 POST 推送通知时服务器不会去重
+IDEMPOTENT_METHOD_SET = {"GET", "HEAD"}
+# 重试的基础等待时间, 单位秒, 第 n 次重试等待 [0, base * 2^n] 之间的随机时间
+RETRY_BACKOFF_BASE = 0.5
+# 重试的最大等待时间, 单位秒
+RETRY_BACKOFF_MAX = 10
+# 每个域名连接池保持的最大连接数
+POOL_MAXSIZE = 10
+
+_session_dict: Dict[str, "requests.Session"] = {}
+_session_lock = threading.Lock()
+
+# 每个域名两次请求之间的最小间隔, 单位秒
+_min_interval_dict: Dict[str, float] = {}
+# 每个域名下一次允许请求的时间
+_next_request_time_dict: Dict[str, float] = {}
+_rate_limit_lock = threading.Lock()
+
+# 每个域名同时进行的最大请求数, 每次请求时占用一个名额, 嵌套的并发请求也不会超过限制
+_concurrency_semaphore_dict: Dict[str, threading.BoundedSemaphore] = {}
+_concurrency_lock = threading.Lock()
+
+
+def set_host_rate_limit(host: str, requests_per_second: float) -> None:
+    """
+    设置域名的请求频率限制
+
+    Args:
+        host: 域名, 例如 fund.eastmoney.com
+        requests_per_second: 每秒最多的请求数, 小于等于 0 时取消限制
+    """
+    with _rate_limit_lock:
+        if requests_per_second <= 0:
+            _min_interval_dict.pop(host, None)
+        else:
+            _min_interval_dict[host] = 1.0 / requests_per_second
+
+
+def set_host_concurrency_limit(host: str, max_concurrency: int) -> None:
+    """
+    设置域名同时进行的最大请求数
+
+    限制在每一次请求时生效, 调用方的线程池再大, 同一个域名同时发出的请求也不会超过限制。
+
+    Args:
+        host: 域名, 例如 fund.eastmoney.com
+        max_concurrency: 同时进行的最大请求数, 小于等于 0 时取消限制
+    """
+    with _concurrency_lock:
+        if max_concurrency <= 0:
+            _concurrency_semaphore_dict.pop(host, None)
+        else:
+            _concurrency_semaphore_dict[host] = threading.BoundedSemaphore(max_concurrency)
+
+
+def host_concurrency_slot(host: str) -> ContextManager:
+    """
+    占用域名的一个请求名额, 没有设置限制时不等待
+
+    Args:
+        host: 域名
+
+    Returns:
+        请求期间持有的上下文管理器
+    """
+    with _concurrency_lock:
+        semaphore = _concurrency_semaphore_dict.get(host)
+    return semaphore if semaphore is not None else nullcontext()
+
+
+def get_session(host: str) -> "requests.Session":
+    """
+    获取域名对应的共享会话, 同一个域名的请求复用 keep-alive 连接
+
+    Args:
+        host: 域名
+
+    Returns:
+        该域名共享的 requests.Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _session_lock:
+        session = _session_dict.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session_dict[host] = session
+        return session
+
+
+def request(method: str, url: str, timeout: float = DEFAULT_TIMEOUT, max_retries: Optional[int] = None,
+            **kwargs) -> "requests.Response":
+    """
+    发送请求
+
+    使用域名共享的连接池, 遵守域名的频率限制和并发限制, 遇到连接错误、超时或者 5xx 状态码时按照指数退避加随机抖动重试。
+    重试等待期间不占用并发名额。连接中断或者超时时请求可能已经被服务器处理, 所以默认只重试 GET 和 HEAD 请求。
+    最后一次仍然是 5xx 时直接返回响应, 由调用方决定是否 raise_for_status。
+
+    Args:
+        method: 请求方法, 例如 GET, POST
+        url: 请求地址
+        timeout: 请求超时时间, 单位秒
+        max_retries: 最大重试次数, 默认 GET 和 HEAD 为 DEFAULT_MAX_RETRIES, 其他方法不重试
+        **kwargs: 透传给 requests 的其他参数, 例如 headers, json
+
+    Returns:
+        requests.Response 对象
+
+    Raises:
+        requests.RequestException: 重试后仍然失败
+    """
+    import requests
+
+    if max_retries is None:
+        max_retries = DEFAULT_MAX_RETRIES if method.upper() in IDEMPOTENT_METHOD_SET else 0
+    host = urlparse(url).netloc
+    session = get_session(host)
+
+    for attempt in range(max_retries):
+        wait_rate_limit(host)
+        try:
+            with host_concurrency_slot(host):
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            if response.status_code < 500:
+                return response
+            response.close()
+        except (requests.ConnectionError, requests.Timeout):
+            pass
+        time.sleep(backoff_delay(attempt))
+
+    # 最后一次请求, 失败时直接抛出异常或者返回 5xx 响应
+    wait_rate_limit(host)
+    with host_concurrency_slot(host):
+        return session.request(method, url, timeout=timeout, **kwargs)
+
+
+def get(url: str, **kwargs) -> "requests.Response":
+    """
+    发送 GET 请求, 参数同 request
+
+    Args:
+        url: 请求地址
+        **kwargs: 其他参数
+
+    Returns:
+        requests.Response 对象
+    """
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> "requests.Response":
+    """
+    发送 POST 请求, 参数同 request, 默认不重试
+
+    Args:
+        url: 请求地址
+        **kwargs: 其他参数
+
+    Returns:
+        requests.Response 对象
+    """
+    return request("POST", url, **kwargs)
+
+
+def wait_rate_limit(host: str) -> None:
+    """
+    等待到域名允许下一次请求的时间
+
+    Args:
+        host: 域名
+    """
+    with _rate_limit_lock:
+        min_interval = _min_interval_dict.get(host)
+        if min_interval is None:
+            return
+        now = time.monotonic()
+        request_time = max(now, _next_request_time_dict.get(host, now))
+        _next_request_time_dict[host] = request_time + min_interval
+
+    if request_time > now:
+        time.sleep(request_time - now)
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    计算第几次重试前需要等待的时间, 使用 full jitter 避免多个请求同时重试
+
+    Args:
+        attempt: 已经失败的次数, 从 0 开始
+
+    Returns:
+        等待时间, 单位秒
+    """
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)))
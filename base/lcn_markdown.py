@@ -0,0 +1,106 @@
+from typing import Any, List, Sequence
+
+try:
+    import wcwidth
+except ImportError:
+    wcwidth = None
+
+# 表头两侧至少保留的空白, 和 tabulate 的 MIN_PADDING 一致
+MIN_PADDING = 2
+
+
+def render_pipe_table(headers: Sequence[str], rows: Sequence[Sequence[Any]], float_formats: Sequence[str]) -> str:
+    """
+    生成 markdown 表格
+
+    输出和 pandas.DataFrame.to_markdown(index=False, floatfmt=float_formats) 一致, 即 tabulate 的 pipe 格式:
+    全部为数字的列按照小数点对齐并右对齐, 其他列左对齐。安装了 wcwidth 时和 tabulate 一样按照显示宽度计算中文的宽度。
+
+    Args:
+        headers: 表头
+        rows: 每一行的数据
+        float_formats: 每一列小数的格式, 例如 ".2f", 空字符串表示原样输出
+
+    Returns:
+        markdown 表格字符串, 不包含结尾的换行
+    """
+    column_list = [list(column) for column in zip(*rows)] if rows else []
+    cell_column_list = []
+    align_list = []
+    for values, float_format in zip(column_list, float_formats):
+        cells, align = _format_column(values, float_format)
+        cell_column_list.append(cells)
+        align_list.append(align)
+
+    width_list = []
+    for index, header in enumerate(headers):
+        width = visible_width(header) + MIN_PADDING
+        if index < len(cell_column_list):
+            width = max([width] + [visible_width(cell) for cell in cell_column_list[index]])
+        width_list.append(width)
+
+    # 没有数据时表头左对齐, 分隔行不带对齐的冒号
+    header_align_list = align_list or ["left"] * len(headers)
+    lines = [_join_row([_pad(header, align, width)
+                        for header, align, width in zip(headers, header_align_list, width_list)])]
+    lines.append("|" + "|".join(_separator_segment(align, width + 2)
+                                for align, width in zip(align_list or [""] * len(headers), width_list)) + "|")
+    for row in zip(*cell_column_list):
+        lines.append(_join_row([_pad(cell, align, width) for cell, align, width in zip(row, align_list, width_list)]))
+    return "\n".join(lines)
+
+
+def visible_width(content: str) -> int:
+    """
+    字符串的显示宽度
+
+    Args:
+        content: 字符串
+
+    Returns:
+        安装了 wcwidth 时为显示宽度, 否则为字符数
+    """
+    # 数字和日期都是 ASCII, 不需要逐个字符计算宽度
+    if wcwidth is not None and not content.isascii():
+        return wcwidth.wcswidth(content)
+    return len(content)
+
+
+def _format_column(values: List[Any], float_format: str):
+    """格式化一列数据, 返回 (单元格字符串列表, 对齐方式)"""
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return [f"{value}".strip() for value in values], "left"
+
+    if all(isinstance(value, int) for value in values):
+        return [f"{value}" for value in values], "right"
+
+    cells = [format(float(value), float_format) for value in values]
+    # 按照小数点对齐: 小数位数不足的在右边补空格
+    after_point_list = [_after_point(cell) for cell in cells]
+    max_after_point = max(after_point_list)
+    return [cell + " " * (max_after_point - after_point) for cell, after_point in zip(cells, after_point_list)], "right"
+
+
+def _after_point(cell: str) -> int:
+    """小数点后的字符数, 没有小数点时为 -1"""
+    position = cell.rfind(".")
+    if position < 0:
+        position = cell.lower().rfind("e")
+    return len(cell) - position - 1 if position >= 0 else -1
+
+
+def _pad(cell: str, align: str, width: int) -> str:
+    padding = " " * (width - visible_width(cell))
+    return padding + cell if align == "right" else cell + padding
+
+
+def _separator_segment(align: str, width: int) -> str:
+    if align == "right":
+        return "-" * (width - 1) + ":"
+    if align == "left":
+        return ":" + "-" * (width - 1)
+    return "-" * width
+
+
+def _join_row(cells: List[str]) -> str:
+    return "|" + "|".join(f" {cell} " for cell in cells) + "|"
@@ -24,3 +24,18 @@ def before_today(before_day):
     """
     days_ago = datetime.now() - timedelta(days=before_day)
     return days_ago.strftime('%Y-%m-%d')
+
+
+def add_days(date_str, days):
+    """
+    获取指定日期加上若干天后的日期
+
+    Args:
+        date_str: yyyy-mm-dd 格式的字符串
+        days: 天数, 负数表示之前的日期
+
+    Returns:
+        计算后的日期, yyyy-mm-dd 格式的字符串
+    """
+    date_obj = datetime.strptime(date_str, '%Y-%m-%d') + timedelta(days=days)
+    return date_obj.strftime('%Y-%m-%d')
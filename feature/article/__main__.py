@@ -1,4 +1,14 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from base import lcn_file, lcn_http
+from feature.article.support.asset_localizer import AssetLocalizer
 from feature.article.support.base_article_crawler import ArticleCrawler
+from feature.article.support.crawl_cache import CrawlCache
 from feature.article.support.csdn_crawler import CSDNCrawler
 from feature.article.support.jianshu_crawler import JianshuCrawler
 from feature.article.support.juejin_crawler import JuejinCrawler
@@ -7,7 +17,7 @@ from feature.article.support.zhihu_crawler import ZhihuCrawler
 prog = "article_crawler"
 description = "A package for crawling markdown formatted articles from certain webpage and storing them locally."
 version = '0.0.1'
-usage = "python3 -m article_crawler -u [url] -t [type] -o [output_folder] -c [class_] -i [id]"
+usage = "python3 -m article_crawler -u [url] | -f [url_file] -t [type] -o [output_folder] -c [class_] -i [id]"
 
 class_dic = {
     "csdn": CSDNCrawler,
@@ -16,45 +26,304 @@ class_dic = {
     "zhihu": ZhihuCrawler
 }
 
+# 域名 -> 文章类型, 域名本身或者子域名都可以匹配, 例如 blog.csdn.net, zhuanlan.zhihu.com
+host_type_dic = {
+    "csdn.net": "csdn",
+    "jianshu.com": "jianshu",
+    "juejin.cn": "juejin",
+    "zhihu.com": "zhihu"
+}
+
+# 批量抓取时记录已经抓取过的地址, 保存在输出目录下
+MANIFEST_FILE_NAME = "crawled_urls.json"
+# 抓取缓存的索引文件, 保存在输出目录下
+CACHE_FILE_NAME = "crawl_cache.json"
+# 图片本地化时默认的资源目录, 在输出目录下
+ASSET_FOLDER_NAME = "assets"
+# 批量抓取默认的并发数
+DEFAULT_MAX_WORKERS = 4
+# 批量抓取时每个站点默认每秒最多的请求数
+DEFAULT_RATE_LIMIT = 1.0
+
+
+def infer_article_type(url):
+    """
+    根据地址的域名推断文章类型
+
+    Args:
+        url: 文章地址
+
+    Returns:
+        class_dic 中的文章类型, 不支持的站点返回空字符串
+    """
+    host = urlparse(url).hostname or ""
+    for domain, article_type in host_type_dic.items():
+        if host == domain or host.endswith("." + domain):
+            return article_type
+    return ""
+
+
+def read_url_list(url_file):
+    """
+    读取地址列表, 每行一个地址, 忽略空行、# 开头的注释和重复的地址
+
+    Args:
+        url_file: 文件路径, 为 - 时从标准输入读取
+
+    Returns:
+        按照出现顺序去重后的地址列表
+    """
+    if url_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(url_file, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    url_list = [line.strip() for line in lines]
+    return list(dict.fromkeys(url for url in url_list if url and not url.startswith("#")))
+
+
+def load_manifest(output_folder):
+    """
+    读取已经抓取过的地址记录
+
+    Args:
+        output_folder: 输出目录
+
+    Returns:
+        地址 -> {"md_path": markdown 文件路径, "crawled_at": 抓取时间}
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"read {manifest_path} failed, crawl all urls again: {e}")
+        return {}
+
+
+def save_manifest(output_folder, manifest):
+    """
+    保存已经抓取过的地址记录, 先写临时文件再替换, 中途退出不会留下损坏的记录
+
+    Args:
+        output_folder: 输出目录
+        manifest: 地址记录
+    """
+    lcn_file.write_text_atomically(os.path.join(output_folder, MANIFEST_FILE_NAME),
+                                   json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+def create_crawler(url, output_folder, type, website_tag, class_, id, cache=None, converter_pool=None,
+                   asset_localizer=None):
+    """
+    创建地址对应的爬虫
+
+    Args:
+        url: 文章地址
+        output_folder: 输出目录
+        type: 文章类型, 为空时根据域名推断
+        website_tag: 文章内容所在的标签, 不支持的站点使用
+        class_: 文章内容所在标签的 class, 不支持的站点使用
+        id: 文章内容所在标签的 id, 不支持的站点使用
+        cache: 抓取缓存
+        converter_pool: html 转 markdown 的进程池
+        asset_localizer: 图片本地化
+
+    Returns:
+        爬虫对象
+
+    Raises:
+        ValueError: 不支持的站点并且没有指定文章内容的位置
+    """
+    type = type or infer_article_type(url)
+    if type:
+        return class_dic[type](url=url, output_folder=output_folder, cache=cache, converter_pool=converter_pool,
+                               asset_localizer=asset_localizer)
+    if not website_tag and not class_ and not id:
+        raise ValueError(f"unsupported site {urlparse(url).hostname}, specify 'class_' or 'id' to locate the article")
+    return ArticleCrawler(url=url, output_folder=output_folder, tag=website_tag, class_=class_, id=id, cache=cache,
+                          converter_pool=converter_pool, asset_localizer=asset_localizer)
+
+
+def crawl_one(crawler):
+    """
+    抓取一篇文章
+
+    Args:
+        crawler: 爬虫对象
+
+    Returns:
+        保存的 markdown 文件路径
+
+    Raises:
+        RuntimeError: 请求失败
+    """
+    if not crawler.start():
+        raise RuntimeError("request failed")
+    return crawler.md_path
+
+
+def crawl_batch(url_list, output_folder, type="", website_tag="", class_="", id="",
+                max_workers=DEFAULT_MAX_WORKERS, rate_limit=DEFAULT_RATE_LIMIT, refresh=False, processes=0,
+                asset_folder=None):
+    """
+    并发抓取多篇文章
+
+    每个站点按照 rate_limit 限制请求频率, 已经抓取过并且 markdown 文件仍然存在的地址直接跳过。
+    refresh 时重新检查已经抓取过的地址, 通过抓取缓存发送条件请求, 文章没有变化时不会重新写入
+
+    Args:
+        url_list: 文章地址列表
+        output_folder: 输出目录
+        type: 文章类型, 为空时根据每个地址的域名推断
+        website_tag: 文章内容所在的标签, 不支持的站点使用
+        class_: 文章内容所在标签的 class, 不支持的站点使用
+        id: 文章内容所在标签的 id, 不支持的站点使用
+        max_workers: 最大并发数
+        rate_limit: 每个站点每秒最多的请求数, 小于等于 0 时不限制
+        refresh: 是否重新检查已经抓取过的地址
+        processes: html 转 markdown 的进程数, 为 0 时在抓取线程中转换
+        asset_folder: 图片本地化的资源目录, 为 None 时保留远程图片地址
+
+    Returns:
+        (成功的地址列表, 跳过的地址列表, 失败的 (地址, 原因) 列表)
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = load_manifest(output_folder)
+    cache = CrawlCache(os.path.join(output_folder, CACHE_FILE_NAME))
+
+    # 进程池在第一次提交任务时才启动进程, 所有地址都跳过时没有额外开销
+    converter_pool = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+    asset_localizer = AssetLocalizer(asset_folder) if asset_folder else None
+
+    skipped_list = []
+    failed_list = []
+    crawler_list = []
+    for url in url_list:
+        record = manifest.get(url)
+        if not refresh and record and record.get("md_path") and os.path.exists(record["md_path"]):
+            skipped_list.append(url)
+            continue
+        try:
+            crawler_list.append(create_crawler(url, output_folder, type, website_tag, class_, id, cache,
+                                               converter_pool, asset_localizer))
+        except ValueError as e:
+            failed_list.append((url, str(e)))
+
+    for host in {urlparse(crawler.url).netloc for crawler in crawler_list}:
+        lcn_http.set_host_rate_limit(host, rate_limit)
+
+    succeeded_list = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_dic = {executor.submit(crawl_one, crawler): crawler.url for crawler in crawler_list}
+            for future in as_completed(future_dic):
+                url = future_dic[future]
+                try:
+                    md_path = future.result()
+                except Exception as e:
+                    failed_list.append((url, f"{e.__class__.__name__}: {e}"))
+                    continue
+                manifest[url] = {"md_path": md_path, "crawled_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+                succeeded_list.append(url)
+    finally:
+        # 中途中断时也保存已经成功的地址
+        save_manifest(output_folder, manifest)
+        cache.save()
+        if converter_pool is not None:
+            converter_pool.shutdown()
+        if asset_localizer is not None:
+            asset_localizer.close()
+
+    return succeeded_list, skipped_list, failed_list
+
+
+def print_batch_summary(succeeded_list, skipped_list, failed_list):
+    print(f"succeeded: {len(succeeded_list)}, skipped: {len(skipped_list)}, failed: {len(failed_list)}")
+    for url, reason in failed_list:
+        print(f"  failed {url}: {reason}")
+
 
 def main():
     url = options.url
+    url_file = options.url_file
     type = options.type
     output_folder = options.output_folder
     website_tag = options.website_tag
     class_ = options.class_
     id = options.id
-    if not url:
-        parser.error("url must be specified.")
+    if not url and not url_file:
+        parser.error("url or url file must be specified.")
     if not output_folder:
         parser.error("output folder must be specified.")
+    if type != '' and type not in ["csdn", "juejin", "zhihu", "jianshu"]:
+        parser.error(
+            "The current article type is not supported, you need to specify 'class_' or 'id' to locate the position of the article.")
+
+    asset_folder = None
+    if options.localize_assets:
+        asset_folder = options.asset_folder or os.path.join(output_folder, ASSET_FOLDER_NAME)
+
+    if url_file:
+        succeeded_list, skipped_list, failed_list = crawl_batch(
+            read_url_list(url_file), output_folder, type=type, website_tag=website_tag, class_=class_, id=id,
+            max_workers=options.max_workers, rate_limit=options.rate_limit, refresh=options.refresh,
+            processes=options.processes, asset_folder=asset_folder)
+        print_batch_summary(succeeded_list, skipped_list, failed_list)
+        if failed_list:
+            sys.exit(1)
+        return
+
     if type == "" and website_tag == "" and class_ == "" and id == "":
         parser.error("'type', 'website_tag', 'class_', 'id' cannot be empty at the same time.")
+    cache = CrawlCache(os.path.join(output_folder, CACHE_FILE_NAME))
+    asset_localizer = AssetLocalizer(asset_folder) if asset_folder else None
     if type != '':
-        if type not in ["csdn", "juejin", "zhihu", "jianshu"]:
-            parser.error(
-                "The current article type is not supported, you need to specify 'class_' or 'id' to locate the position of the article.")
-        crawler = class_dic[type](url=url, output_folder=output_folder)
+        crawler = class_dic[type](url=url, output_folder=output_folder, cache=cache, asset_localizer=asset_localizer)
     else:
-        crawler = ArticleCrawler(url=url, output_folder=output_folder, tag=website_tag, class_=class_, id=id)
-    crawler.start()
+        crawler = ArticleCrawler(url=url, output_folder=output_folder, tag=website_tag, class_=class_, id=id,
+                                 cache=cache, asset_localizer=asset_localizer)
+    try:
+        if crawler.start():
+            cache.save()
+    finally:
+        if asset_localizer is not None:
+            asset_localizer.close()
 
 
 if __name__ == '__main__':
     from optparse import OptionParser
     # https://juejin.cn/post/7263840667826323493
     # -u https://juejin.cn/post/7326923332196237351 -o /Users/lcn/Downloads/note -t juejin
+    # -f /Users/lcn/Downloads/urls.txt -o /Users/lcn/Downloads/note
     parser = OptionParser(prog=prog, description=description, version='%prog ' + version, usage=usage)
-    parser.add_option("-u", "--url", dest="url", help="crawled url (required)")
+    parser.add_option("-u", "--url", dest="url", help="crawled url (required unless 'url_file' is specified)")
+    parser.add_option("-f", "--url_file", dest="url_file",
+                      help="file with one url per line, '-' to read from stdin, the crawler is inferred from the host")
     parser.add_option("-t", "--type", dest="type", default="",
                       help="crawled article type [csdn] | [juejin] | [zhihu] | [jianshu]")
     parser.add_option("-o", "--output_folder", dest="output_folder",
                       help="output html / markdown / pdf folder (required)")
-    parser.add_option("-w", "--website_tag", dest="website_tag",
+    parser.add_option("-w", "--website_tag", dest="website_tag", default="",
                       help="position of the article content in HTML (not required if 'type' is specified)")
     parser.add_option("-c", "--class", dest="class_", default="",
                       help="position of the article content in HTML (not required if 'type' is specified)")
     parser.add_option("-i", "--id", dest="id", default="",
                       help="position of the article content in HTML (not required if 'type' is specified)")
+    parser.add_option("-n", "--max_workers", dest="max_workers", type="int", default=DEFAULT_MAX_WORKERS,
+                      help=f"number of urls crawled at the same time in batch mode, default {DEFAULT_MAX_WORKERS}")
+    parser.add_option("-r", "--rate_limit", dest="rate_limit", type="float", default=DEFAULT_RATE_LIMIT,
+                      help=f"max requests per second for each site in batch mode, default {DEFAULT_RATE_LIMIT}")
+    parser.add_option("-p", "--processes", dest="processes", type="int", default=0,
+                      help="number of processes converting html to markdown in batch mode, "
+                           "default 0 to convert in the crawling threads")
+    parser.add_option("-a", "--localize_assets", dest="localize_assets", action="store_true", default=False,
+                      help="download images of the articles and rewrite the links to local files")
+    parser.add_option("--asset_folder", dest="asset_folder", default="",
+                      help="folder shared by all articles to store downloaded images, default [output_folder]/assets")
+    parser.add_option("--refresh", dest="refresh", action="store_true", default=False,
+                      help="check crawled urls again in batch mode, unchanged articles are not rewritten")
     options, args = parser.parse_args()
     main()
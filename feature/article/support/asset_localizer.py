@@ -0,0 +1,166 @@
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+from base import lcn_file, lcn_http
+
+# 图片地址所在的属性, 按照顺序使用第一个有值的, 懒加载的图片真实地址通常在 data-* 属性中
+IMAGE_SOURCE_ATTRIBUTE_LIST = ["data-original", "data-actualsrc", "data-src", "src"]
+# 本地化后需要删除的属性, 否则浏览器仍然会加载远程图片
+REMOTE_ATTRIBUTE_LIST = ["srcset", "data-srcset"]
+# 可以直接使用地址中的后缀作为文件后缀的图片类型
+IMAGE_EXTENSION_SET = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".bmp", ".ico", ".avif"}
+# 地址 -> 文件名的索引文件, 保存在资源目录下
+INDEX_FILE_NAME = "index.json"
+# 同时下载的最大图片数
+DEFAULT_MAX_WORKERS = 8
+# 下载图片的超时时间, 单位秒
+DEFAULT_TIMEOUT = 20
+
+
+class AssetLocalizer:
+    """
+    文章图片本地化, 下载文章中的图片并将链接改为本地文件
+
+    图片按照内容的 sha256 命名保存在共享的资源目录中, 不同文章中相同的图片只保存一份。
+    已经下载过的地址记录在索引中, 再次抓取时直接使用本地文件。多个爬虫线程可以共享同一个对象。
+    """
+
+    def __init__(self, asset_folder, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+        # 资源目录
+        self._asset_folder = asset_folder
+        # 下载图片的超时时间
+        self._timeout = timeout
+        # 图片地址 -> 资源目录中的文件名
+        self._index_dict = {}
+        # 图片地址 -> 进行中的下载任务, 多篇文章同时引用同一张图片时只下载一次, 完成后移除
+        self._future_dict = {}
+        self._lock = threading.Lock()
+        # 所有文章共享的下载线程池, 连接由 lcn_http 按照域名复用
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asset")
+        os.makedirs(asset_folder, exist_ok=True)
+        self._load()
+
+    @property
+    def asset_folder(self):
+        return self._asset_folder
+
+    def localize(self, element, base_url, output_folder):
+        """
+        下载元素中的所有图片并将 src 改为本地文件的相对路径, 下载失败的图片保留远程地址
+
+        Args:
+            element: 文章内容的 lxml 元素, 直接修改
+            base_url: 文章地址, 用于补全相对地址和作为 Referer
+            output_folder: 保存文章的目录, 图片链接为相对该目录的路径
+
+        Returns:
+            本地化成功的图片数量
+        """
+        image_dict = {}
+        for image in element.iter("img"):
+            source = next((image.get(name) for name in IMAGE_SOURCE_ATTRIBUTE_LIST if image.get(name)), None)
+            if not source or source.startswith("data:"):
+                continue
+            image_dict.setdefault(urljoin(base_url, source.strip()), []).append(image)
+
+        submitted_url_list = []
+        with self._lock:
+            for url in image_dict:
+                if url not in self._future_dict:
+                    self._future_dict[url] = self._executor.submit(self.download, url, base_url)
+                    submitted_url_list.append(url)
+            future_dict = {url: self._future_dict[url] for url in image_dict}
+        # 完成后移除, 失败的图片后面的文章会重新下载, 成功的由 download 直接返回本地文件。
+        # 已经完成的任务会在当前线程立即回调, 所以不能在持有锁时注册
+        for url in submitted_url_list:
+            future_dict[url].add_done_callback(lambda future, done_url=url: self._remove_future(done_url, future))
+        localized_count = 0
+        for url, future in future_dict.items():
+            try:
+                file_name = future.result()
+            except Exception as e:
+                print(f"download {url} failed, keep the remote link: {e}")
+                continue
+            relative_path = os.path.relpath(os.path.join(self._asset_folder, file_name), output_folder)
+            for image in image_dict[url]:
+                image.set("src", relative_path.replace(os.sep, "/"))
+                for name in REMOTE_ATTRIBUTE_LIST:
+                    image.attrib.pop(name, None)
+            localized_count += 1
+        return localized_count
+
+    def download(self, url, referer=None):
+        """
+        下载一张图片, 已经下载过的地址直接返回本地文件
+
+        Args:
+            url: 图片地址
+            referer: 请求时的 Referer, 部分图床会校验
+
+        Returns:
+            资源目录中的文件名
+
+        Raises:
+            RuntimeError: 下载失败
+        """
+        with self._lock:
+            file_name = self._index_dict.get(url)
+        if file_name and os.path.exists(os.path.join(self._asset_folder, file_name)):
+            return file_name
+
+        headers = {"Referer": referer} if referer else {}
+        response = lcn_http.get(url, headers=headers, timeout=self._timeout)
+        if response.status_code != 200 or not response.content:
+            raise RuntimeError(f"status code {response.status_code}")
+
+        file_name = hashlib.sha256(response.content).hexdigest() + self._guess_extension(url, response)
+        file_path = os.path.join(self._asset_folder, file_name)
+        if not os.path.exists(file_path):
+            # 先写临时文件再替换, 多个线程同时写入同一张图片时不会得到不完整的文件
+            temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(temp_path, file_path)
+
+        with self._lock:
+            self._index_dict[url] = file_name
+        return file_name
+
+    def save(self):
+        """保存图片地址索引"""
+        with self._lock:
+            content = json.dumps(self._index_dict, ensure_ascii=False)
+        lcn_file.write_text_atomically(os.path.join(self._asset_folder, INDEX_FILE_NAME), content)
+
+    def close(self):
+        """等待下载结束并保存索引"""
+        self._executor.shutdown()
+        self.save()
+
+    def _remove_future(self, url, future):
+        with self._lock:
+            if self._future_dict.get(url) is future:
+                del self._future_dict[url]
+
+    def _load(self):
+        index_path = os.path.join(self._asset_folder, INDEX_FILE_NAME)
+        if not os.path.exists(index_path):
+            return
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self._index_dict = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"read {index_path} failed, download all images again: {e}")
+
+    @staticmethod
+    def _guess_extension(url, response):
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if extension in IMAGE_EXTENSION_SET:
+            return extension
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        return mimetypes.guess_extension(content_type) or ""
@@ -2,8 +2,10 @@ import os.path
 import random
 
 import html2text
-import requests
-from bs4 import BeautifulSoup
+import lxml.html
+
+from base import lcn_file, lcn_http
+from feature.article.support.crawl_cache import hash_content
 
 html_str = """
 <!DOCTYPE html>
@@ -33,8 +35,54 @@ USER_AGENT_LIST = [
 ]
 
 
+def html_to_markdown(html, converter_pool=None):
+    """
+    将 html 转为 markdown
+
+    Args:
+        html: html 内容
+        converter_pool: 执行转换的进程池, 为 None 时在当前线程转换
+
+    Returns:
+        markdown 内容
+    """
+    if converter_pool is None:
+        return html2text.html2text(html)
+    # html2text 是纯 Python 的 CPU 密集计算, 放到进程池中不会占用 GIL, 其他线程可以继续请求
+    return converter_pool.submit(html2text.html2text, html).result()
+
+
+def build_content_xpath(tag, class_, id):
+    """
+    生成定位文章内容的 xpath, 查找方式和 BeautifulSoup.find(tag, id=id, class_=class_) 一致:
+    class_ 为单个 class 时匹配包含该 class 的标签, 包含空格时匹配 class 列表按照空格拼接后相同的标签。
+    参数为空时不作为查找条件, 需要配合 $id, $class_name 变量使用
+
+    Args:
+        tag: 标签名
+        class_: class
+        id: id
+
+    Returns:
+        xpath 字符串
+    """
+    condition_list = []
+    if id:
+        condition_list.append("@id=$id")
+    if class_:
+        if len(class_.split()) == 1 and class_ == class_.strip():
+            condition_list.append('contains(concat(" ", normalize-space(@class), " "), concat(" ", $class_name, " "))')
+        else:
+            condition_list.append("normalize-space(@class)=$class_name")
+    return f"//{tag or '*'}" + "".join(f"[{condition}]" for condition in condition_list)
+
+
 class ArticleCrawler:
-    def __init__(self, url, output_folder, tag, class_, id=''):
+    # 文章标题的 xpath, 为 None 时文件名为 article
+    title_xpath = None
+
+    def __init__(self, url, output_folder, tag, class_, id='', cache=None, converter_pool=None,
+                 asset_localizer=None):
         self.url = url
         self.headers = {
             'user-agent': random.choice(USER_AGENT_LIST)
@@ -44,46 +92,130 @@ class ArticleCrawler:
         self.id = id
         self.html_str = html_str
         if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
+            # 批量抓取时多个线程可能同时创建
+            os.makedirs(output_folder, exist_ok=True)
             print(f"{output_folder} does not exist, automatically create...")
         self.output_folder = output_folder
+        # 抓取缓存 CrawlCache, 为 None 时每次都完整下载并重新写入
+        self.cache = cache
+        # html 转 markdown 的进程池, 为 None 时在当前线程转换
+        self.converter_pool = converter_pool
+        # 图片本地化 AssetLocalizer, 为 None 时保留远程图片地址
+        self.asset_localizer = asset_localizer
+        # 最近一次写入的 html, markdown 文件路径
+        self.html_path = None
+        self.md_path = None
 
     def send_request(self, url):
-        response = requests.get(url=url, headers=self.headers)
+        headers = dict(self.headers)
+        if self.cache is not None:
+            # 抓取过的地址发送条件请求, 没有变化时服务器返回 304, 不需要下载页面
+            headers.update(self.cache.conditional_headers(url))
+        response = lcn_http.get(url=url, headers=headers)
         response.encoding = "utf-8"
-        if response.status_code == 200:
+        if response.status_code in (200, 304):
             return response
 
     def parse_detail(self, response):
-        html = response.text
-        soup = BeautifulSoup(html, 'lxml')
-        content = soup.find(self.tag, id=self.id, class_=self.class_)
+        # 页面只解析一次, 标题和文章内容都从同一棵树中查找
+        tree = self.parse_html(response.text)
+        title = self.extract_title(tree)
+        content = self.extract_content(tree)
         html = self.html_str.format(article=content)
-        self.write_content(html, 'article')
+        self.write_content(html, title)
+
+    def parse_html(self, html):
+        # 按照字节解析, 兼容带有 <?xml encoding=...?> 声明的页面
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        return lxml.html.fromstring(html.encode("utf-8"), parser=parser)
+
+    def extract_title(self, tree):
+        if self.title_xpath is None:
+            return 'article'
+        result_list = tree.xpath(self.title_xpath)
+        if not result_list:
+            raise RuntimeError(f"title not found by {self.title_xpath}")
+        title = result_list[0]
+        return title.text_content() if isinstance(title, lxml.html.HtmlElement) else str(title)
+
+    def extract_content(self, tree):
+        """
+        查找文章内容, 只序列化文章所在的子树, 开启了图片本地化时先下载图片并改为本地链接
+
+        Args:
+            tree: 页面解析后的树
+
+        Returns:
+            文章内容的 html
+        """
+        xpath = build_content_xpath(self.tag, self.class_, self.id)
+        element_list = tree.xpath(xpath, id=self.id or "", class_name=self.class_ or "")
+        if not element_list:
+            raise RuntimeError(f"article content not found by {xpath}")
+        content = element_list[0]
+        if self.asset_localizer is not None:
+            # HTML 和 MD 目录在同一层, 相对 HTML 目录的图片链接对 markdown 同样有效
+            self.asset_localizer.localize(content, self.url, os.path.join(self.output_folder, "HTML"))
+        return lxml.html.tostring(content, encoding="unicode", with_tail=False)
 
     def write_content(self, content, name):
-        if not os.path.exists(self.output_folder + '/HTML'):
-            os.makedirs(self.output_folder + '/HTML')
-        if not os.path.exists(self.output_folder + '/MD'):
-            os.makedirs(self.output_folder + '/MD')
+        os.makedirs(self.output_folder + '/HTML', exist_ok=True)
+        os.makedirs(self.output_folder + '/MD', exist_ok=True)
         name = self.change_title(name)
         html_path = os.path.join(self.output_folder, "HTML", name + ".html")
         md_path = os.path.join(self.output_folder, "MD", name + ".md")
 
-        with open(html_path, 'w', encoding="utf-8") as f:
-            f.write(content)
-            print(f"create {name}.html in {self.output_folder} successfully")
+        # 页面的其他部分变化但是文章内容没有变化时, 不需要重新写入和转换
+        article_hash = hash_content(content)
+        if self.cache is not None:
+            entry = self.cache.get(self.url)
+            if entry and entry.get("article_hash") == article_hash \
+                    and entry.get("html_path") == html_path and entry.get("md_path") == md_path:
+                print(f"{name} is not changed, skip writing")
+                self.html_path, self.md_path = html_path, md_path
+                return
 
-        html_text = open(html_path, 'r', encoding='utf-8').read()
-        markdown_text = html2text.html2text(html_text)
-        with open(md_path, 'w', encoding='utf-8') as file:
-            file.write(markdown_text)
-            print(f"create {name}.md in {self.output_folder} successfully")
+        # 直接转换内存中的内容, 不需要写入后再读取
+        markdown_text = html_to_markdown(content, self.converter_pool)
+        lcn_file.write_text_atomically(html_path, content)
+        print(f"create {name}.html in {self.output_folder} successfully")
+        lcn_file.write_text_atomically(md_path, markdown_text)
+        print(f"create {name}.md in {self.output_folder} successfully")
+        self.html_path, self.md_path = html_path, md_path
+        if self.cache is not None:
+            self.cache.update(self.url, article_hash=article_hash, html_path=html_path, md_path=md_path)
 
     def change_title(self, title):
         return title
 
     def start(self):
+        """
+        抓取文章并保存
+
+        Returns:
+            是否成功获取到文章, 请求失败时为 False
+        """
         response = self.send_request(self.url)
-        if response:
+        if response is None:
+            return False
+        if self.cache is None:
             self.parse_detail(response)
+            return True
+
+        validator_dict = {"etag": response.headers.get("ETag"),
+                          "last_modified": response.headers.get("Last-Modified")}
+        entry = self.cache.get(self.url)
+        if response.status_code == 304:
+            if entry is None:
+                raise RuntimeError(f"{self.url} is not modified, but the crawl cache has no record")
+        else:
+            validator_dict["content_hash"] = hash_content(response.content)
+            if entry is None or entry.get("content_hash") != validator_dict["content_hash"]:
+                self.parse_detail(response)
+                self.cache.update(self.url, **validator_dict)
+                return True
+
+        print(f"{self.url} is not modified, skip")
+        self.html_path, self.md_path = entry["html_path"], entry["md_path"]
+        self.cache.update(self.url, **{key: value for key, value in validator_dict.items() if value})
+        return True
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from base import lcn_file
+
+# 缓存索引默认最多保存的地址数量, 超出时淘汰最久没有访问的地址
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def hash_content(content):
+    """
+    计算内容的 sha256
+
+    Args:
+        content: 字符串或者字节
+
+    Returns:
+        十六进制的 sha256
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class CrawlCache:
+    """
+    文章抓取缓存, 按照地址记录 ETag、Last-Modified、页面和文章内容的哈希以及输出文件
+
+    再次抓取时发送条件请求, 服务器返回 304 或者内容没有变化时不需要重新解析和写入文件。
+    索引保存为一个 JSON 文件, 按照访问顺序排列, 超过 max_entries 时淘汰最久没有访问的地址。
+    多个线程可以共享同一个缓存。
+    """
+
+    def __init__(self, cache_path, max_entries=DEFAULT_MAX_ENTRIES):
+        # 缓存索引文件路径
+        self._cache_path = cache_path
+        # 最多保存的地址数量
+        self._max_entries = max_entries
+        # 地址 -> 缓存记录, 最近访问的在最后
+        self._entry_dict = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def cache_path(self):
+        return self._cache_path
+
+    @property
+    def max_entries(self):
+        return self._max_entries
+
+    def __len__(self):
+        return len(self._entry_dict)
+
+    def get(self, url):
+        """
+        获取地址的缓存记录, 输出文件已经被删除时视为没有缓存
+
+        Args:
+            url: 文章地址
+
+        Returns:
+            缓存记录的副本, 没有时为 None
+        """
+        with self._lock:
+            entry = self._entry_dict.get(url)
+            if entry is None:
+                return None
+            if not all(os.path.exists(path) for path in (entry.get("html_path"), entry.get("md_path")) if path):
+                del self._entry_dict[url]
+                return None
+            self._entry_dict.move_to_end(url)
+            entry["accessed_at"] = time.time()
+            return dict(entry)
+
+    def conditional_headers(self, url):
+        """
+        生成条件请求的请求头
+
+        Args:
+            url: 文章地址
+
+        Returns:
+            If-None-Match / If-Modified-Since 请求头, 没有缓存时为空
+        """
+        entry = self.get(url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, url, **fields):
+        """
+        更新地址的缓存记录, 没有时新建
+
+        Args:
+            url: 文章地址
+            **fields: 需要更新的字段, 例如 etag, last_modified, content_hash, article_hash, html_path, md_path
+        """
+        with self._lock:
+            entry = self._entry_dict.pop(url, {})
+            entry.update(fields)
+            entry["accessed_at"] = time.time()
+            self._entry_dict[url] = entry
+            while len(self._entry_dict) > self._max_entries:
+                self._entry_dict.popitem(last=False)
+
+    def save(self):
+        """保存缓存索引, 先写临时文件再替换, 中途退出不会留下损坏的索引"""
+        folder = os.path.dirname(self._cache_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            content = json.dumps(self._entry_dict, ensure_ascii=False)
+        lcn_file.write_text_atomically(self._cache_path, content)
+
+    def _load(self):
+        if not os.path.exists(self._cache_path):
+            return
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as f:
+                entry_dict = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"read {self._cache_path} failed, ignore the crawl cache: {e}")
+            return
+        # 兼容手动修改过的索引, 按照访问时间重新排序
+        for url, entry in sorted(entry_dict.items(), key=lambda item: item[1].get("accessed_at", 0)):
+            self._entry_dict[url] = entry
+        while len(self._entry_dict) > self._max_entries:
+            self._entry_dict.popitem(last=False)
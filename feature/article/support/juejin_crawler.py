@@ -1,30 +1,17 @@
 import re
 
-import parsel
-from bs4 import BeautifulSoup
-
 from feature.article.support.base_article_crawler import ArticleCrawler
 
 
 class JuejinCrawler(ArticleCrawler):
-    def __init__(self, url, output_folder, tag="article", class_='article', id=''):
-        super().__init__(url=url, output_folder=output_folder, tag=tag, class_=class_, id=id)
+    title_xpath = "//h1[@class='article-title']/text()"
 
-    def parse_detail(self, response):
-        html = response.text
-        selector = parsel.Selector(html)
-        title = selector.xpath("//h1[@class='article-title']/text()").get()
-        soup = BeautifulSoup(html, 'lxml')
-        content = soup.find(self.tag, class_=self.class_)
-        html = self.html_str.format(article=content)
-        self.write_content(html, title)
+    def __init__(self, url, output_folder, tag="article", class_='article', id='', cache=None,
+                 converter_pool=None, asset_localizer=None):
+        super().__init__(url=url, output_folder=output_folder, tag=tag, class_=class_, id=id, cache=cache,
+                         converter_pool=converter_pool, asset_localizer=asset_localizer)
 
     def change_title(self, title):
         mode = re.compile(r'[\\\/\:\?\*\"\<\>\|\!]')
         new_title = re.sub(mode, '_', title)
         return "".join(new_title.split())
-
-    def start(self):
-        response = self.send_request(self.url)
-        if response:
-            self.parse_detail(response)
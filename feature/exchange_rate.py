@@ -1,12 +1,23 @@
+import json
+import os
+import tempfile
+import time
 from decimal import Decimal
+from typing import Dict, List, Optional, Sequence
 
-import requests
+import numpy as np
+
+from base import lcn_file, lcn_http
 
 CNY_CODE = 'CNY'
 USD_CODE = 'USD'
 HKD_CODE = 'HKD'
 MONEY_CODE_LIST = ['USD', 'CNY', 'HKD']
-REQUEST_URL = f"https://api.exchangerate-api.com/v4/latest/{{code}}"
+REQUEST_URL = "https://api.exchangerate-api.com/v4/latest/{code}"
+# 汇率缓存的有效时间, 单位秒, 接口每天更新一次
+DEFAULT_CACHE_TTL = 12 * 60 * 60
+# 汇率缓存文件
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "exchange_rate_cache.json")
 
 
 def exchange_rate(request_code):
@@ -15,84 +26,132 @@ def exchange_rate(request_code):
     :param request_code: 请求的货币代码，例如 'USD', 'CNY', 'HKD'
     """
     real_request_url = REQUEST_URL.format(code=request_code)
-    response = requests.get(real_request_url, timeout=10)
+    response = lcn_http.get(real_request_url, timeout=10)
     if response.status_code != 200:
         raise RuntimeError(f"Failed to fetch exchange rate data: {response.status_code}")
     data = response.json()
     return data['rates']
 
 
-def exclude_element_from_list(target_list, index):
-    """
-    从列表中排除指定索引的元素
-    :param target_list: 目标列表
-    :param index: 要排除的元素索引
-    :return: 新列表，不包含指定索引的元素
+class ExchangeRateEngine:
     """
+    汇率计算
 
-    length = len(target_list)
-
-    # 处理空列表情况
-    if length == 0:
-        return []
-
-    # 规范化索引（处理负数索引）
-    if index < 0:
-        normalized_index = index + length
-    else:
-        normalized_index = index
-
-    # 检查索引是否有效
-    if 0 <= normalized_index < length:
-        # 使用切片组合排除指定位置的元素
-        return target_list[:normalized_index] + target_list[normalized_index + 1:]
-    else:
-        # 索引无效时返回整个列表的副本
-        return target_list.copy()
-
+    只请求一次以 base_code 为基准的汇率表并缓存到磁盘, 有效期内不再请求接口。
+    任意一组货币的交叉汇率通过一次向量运算得到 N x N 矩阵, 多个金额可以一次换算为所有货币。
+    """
 
-def calculate_exchange_rate(cal_money, cal_code_index, other_rate_map):
+    def __init__(self, base_code: str = USD_CODE, cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+                 ttl: float = DEFAULT_CACHE_TTL):
+        # 汇率表的基准货币
+        self._base_code = base_code
+        # 缓存文件路径, 为 None 时只缓存在内存中
+        self._cache_path = cache_path
+        # 缓存的有效时间, 单位秒
+        self._ttl = ttl
+        # 基准货币 -> 其他货币的汇率
+        self._rate_dict: Optional[Dict[str, float]] = None
+        # 汇率表的获取时间
+        self._fetched_at = 0.0
+
+    @property
+    def base_code(self) -> str:
+        return self._base_code
+
+    @property
+    def rate_dict(self) -> Dict[str, float]:
+        """1 基准货币可以兑换的各货币数量, 缓存过期时重新请求"""
+        if self._rate_dict is None or self._is_expired(self._fetched_at):
+            if not self._load_cache():
+                self.refresh()
+        return self._rate_dict
+
+    def refresh(self) -> None:
+        """重新请求汇率表并写入缓存"""
+        self._rate_dict = {code: float(rate) for code, rate in exchange_rate(self._base_code).items()}
+        self._fetched_at = time.time()
+        if self._cache_path:
+            lcn_file.write_text_atomically(self._cache_path, json.dumps(
+                {"base": self._base_code, "fetched_at": self._fetched_at, "rates": self._rate_dict}))
+
+    def cross_rate_matrix(self, code_list: Sequence[str]) -> np.ndarray:
+        """
+        计算交叉汇率矩阵
+
+        Args:
+            code_list: 货币代码列表
+
+        Returns:
+            N x N 矩阵, [i, j] 为 1 code_list[i] 可以兑换的 code_list[j] 数量
+        """
+        rate_dict = self.rate_dict
+        unknown_code_list = [code for code in code_list if code not in rate_dict]
+        if unknown_code_list:
+            raise ValueError(f"unsupported currency {unknown_code_list}")
+        base_rate_array = np.array([rate_dict[code] for code in code_list], dtype=np.float64)
+        # 1 A = (base -> B) / (base -> A) B
+        return np.outer(1.0 / base_rate_array, base_rate_array)
+
+    def convert(self, amounts, code_list: Sequence[str]) -> np.ndarray:
+        """
+        把多个金额按照每一种货币换算为所有货币
+
+        Args:
+            amounts: 金额列表
+            code_list: 货币代码列表
+
+        Returns:
+            M x N x N 数组, [k, i, j] 为 amounts[k] 个 code_list[i] 可以兑换的 code_list[j] 数量
+        """
+        amount_array = np.asarray(amounts, dtype=np.float64).reshape(-1)
+        return amount_array[:, None, None] * self.cross_rate_matrix(code_list)
+
+    def _is_expired(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at > self._ttl
+
+    def _load_cache(self) -> bool:
+        """读取未过期的磁盘缓存, 成功时返回 True"""
+        if not self._cache_path or not os.path.exists(self._cache_path):
+            return False
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"read {self._cache_path} failed, fetch exchange rate again: {e}")
+            return False
+        if cache.get("base") != self._base_code or self._is_expired(cache.get("fetched_at", 0)):
+            return False
+        self._rate_dict = cache["rates"]
+        self._fetched_at = cache["fetched_at"]
+        return True
+
+
+def show_rate(cal_money, code_list: Optional[List[str]] = None, engine: Optional[ExchangeRateEngine] = None):
     """
-    计算指定货币与其他两种货币的汇率转换
+    打印每一种货币兑换其他货币的汇率和金额
+
+    打印的数值使用 Decimal 计算, 和之前的输出一致; 浮点数保留 3 位小数时可能进位不同, 例如 7.0765 会显示为 7.077 而不是 7.076
     :param cal_money: 要计算的金额
-    :param cal_code_index: 要计算的货币在 MONEY_CODE_LIST 中的索引
-    :param other_rate_map: 其他货币的汇率映射，键为货币代码，值为对应的汇率
+    :param code_list: 货币代码列表, 默认为 MONEY_CODE_LIST
+    :param engine: 汇率计算, 默认使用磁盘缓存
     """
-    other_code_list = exclude_element_from_list(MONEY_CODE_LIST, cal_code_index)
-
-    base_to_other_first_rate = other_rate_map[other_code_list[0]]
-    base_to_other_second_rate = other_rate_map[other_code_list[1]]
-
-    # USD 为基准计算金额
-    base_to_first_money = Decimal(str(base_to_other_first_rate)) * Decimal(str(cal_money))
-    base_to_second_money = Decimal(str(base_to_other_second_rate)) * Decimal(str(cal_money))
-
-    print(
-        f"1 {MONEY_CODE_LIST[cal_code_index]} = {base_to_other_first_rate:.3f} {other_code_list[0]} = {base_to_other_second_rate:.3f} {other_code_list[1]}")
-    print(
-        f"{cal_money:.3f} {MONEY_CODE_LIST[cal_code_index]} = {base_to_first_money:.3f} {other_code_list[0]} = {base_to_second_money:.3f} {other_code_list[1]}")
-
-
-def show_rate(cal_money):
-    usd_to_other_rate_map = exchange_rate(USD_CODE)
-
-    usd_to_cny_rate = Decimal(str(usd_to_other_rate_map[CNY_CODE]))
-    usd_to_hkd_rate = Decimal(str(usd_to_other_rate_map[HKD_CODE]))
-
-    cny_to_usd_rate = Decimal("1.00") / usd_to_cny_rate
-    cny_to_hkd_rate = usd_to_hkd_rate / usd_to_cny_rate
-
-    hkd_to_usd_rate = Decimal("1.00") / usd_to_hkd_rate
-    hkd_to_cny_rate = usd_to_cny_rate / usd_to_hkd_rate
-
-    print(f"以 {USD_CODE} 为基准计算汇率:")
-    calculate_exchange_rate(cal_money, 0, {"CNY": usd_to_cny_rate, "HKD": usd_to_hkd_rate})
-
-    print(f"\n以 {CNY_CODE} 为基准计算汇率:")
-    calculate_exchange_rate(cal_money, 1, {"USD": cny_to_usd_rate, "HKD": cny_to_hkd_rate})
-
-    print(f"\n以 {HKD_CODE} 为基准计算汇率:")
-    calculate_exchange_rate(cal_money, 2, {"USD": hkd_to_usd_rate, "CNY": hkd_to_cny_rate})
+    code_list = code_list or MONEY_CODE_LIST
+    engine = engine or ExchangeRateEngine()
+    # 检查货币代码, 不支持时抛出 ValueError
+    engine.cross_rate_matrix(code_list)
+    base_rate_list = [Decimal(str(engine.rate_dict[code])) for code in code_list]
+    rate_matrix = [[other_rate / base_rate for other_rate in base_rate_list] for base_rate in base_rate_list]
+    money_matrix = [[Decimal(str(rate)) * Decimal(str(cal_money)) for rate in rate_list] for rate_list in rate_matrix]
+
+    for index, code in enumerate(code_list):
+        other_index_list = [other_index for other_index in range(len(code_list)) if other_index != index]
+        if index > 0:
+            print()
+        print(f"以 {code} 为基准计算汇率:")
+        print(f"1 {code} = " + " = ".join(f"{rate_matrix[index][other_index]:.3f} {code_list[other_index]}"
+                                         for other_index in other_index_list))
+        print(f"{cal_money:.3f} {code} = " + " = ".join(
+            f"{money_matrix[index][other_index]:.3f} {code_list[other_index]}" for other_index in other_index_list))
 
 
 # 可以修改为需要计算的金额
@@ -1,8 +1,9 @@
-import requests
 import re
 
+from base import lcn_http
 
-def sc_send(send_key: str, title: str, desp: str = "", options: dict = None) -> dict:
+
+def sc_send(send_key: str, title: str, desp: str = "", options: dict = None, max_retries: int = 0) -> dict:
     """
     Sends a notification using the server酱 (Server酱) or sctp services.
 
@@ -11,6 +12,8 @@ def sc_send(send_key: str, title: str, desp: str = "", options: dict = None) ->
         title (str): The title of the notification.
         desp (str, optional): The description of the notification. Defaults to "".
         options (dict, optional): Additional options for the notification. Defaults to None.
+        max_retries (int, optional): Retries on connection errors or 5xx responses. Defaults to 0, because
+            the service does not dedupe pushes and a retried request may be delivered twice.
 
     Returns:
         dict: The JSON response from the notification service.
@@ -44,7 +47,7 @@ def sc_send(send_key: str, title: str, desp: str = "", options: dict = None) ->
         "Content-Type": "application/json;charset=utf-8"
     }
 
-    response = requests.post(url, json=params, headers=headers)
+    response = lcn_http.post(url, json=params, headers=headers, max_retries=max_retries)
     # Raise an exception for non-2xx status codes
     response.raise_for_status()
     return response.json()
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+from contextlib import closing
+from typing import Optional, Tuple, TYPE_CHECKING
+
+# numpy 导入较慢, 查询时再导入
+if TYPE_CHECKING:
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+# 数据库连接的等待锁超时时间, 单位秒, 多个线程同时写入时需要排队
+CONNECT_TIMEOUT = 30
+
+_CREATE_TABLE_SQL_LIST = [
+    # 基金的历史净值, 每个基金每天一条
+    """
+    CREATE TABLE IF NOT EXISTS nav_history (
+        fund_code TEXT NOT NULL,
+        date TEXT NOT NULL,
+        net_asset_value REAL NOT NULL,
+        PRIMARY KEY (fund_code, date)
+    ) WITHOUT ROWID
+    """,
+    # 基金已经同步过的最早日期, 节假日没有净值, 不能直接用最早的一条数据判断
+    """
+    CREATE TABLE IF NOT EXISTS fund_sync (
+        fund_code TEXT PRIMARY KEY,
+        synced_start_date TEXT NOT NULL
+    )
+    """,
+]
+
+
+def open_store(store_path: str) -> sqlite3.Connection:
+    """
+    打开本地净值存储, 不存在时自动创建
+
+    Args:
+        store_path: SQLite 文件路径
+
+    Returns:
+        数据库连接, 使用后需要关闭
+    """
+    folder = os.path.dirname(store_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    conn = sqlite3.connect(store_path, timeout=CONNECT_TIMEOUT)
+    with conn:
+        for create_sql in _CREATE_TABLE_SQL_LIST:
+            conn.execute(create_sql)
+    return conn
+
+
+def get_synced_range(conn: sqlite3.Connection, fund_code: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    获取基金已经同步的日期范围
+
+    Args:
+        conn: 数据库连接
+        fund_code: 基金代码
+
+    Returns:
+        (已同步的最早日期, 最后一条净值的日期), 没有数据时对应的值为 None
+    """
+    with closing(conn.execute("SELECT synced_start_date FROM fund_sync WHERE fund_code = ?", (fund_code,))) as cursor:
+        row = cursor.fetchone()
+    synced_start_date = row[0] if row else None
+
+    with closing(conn.execute("SELECT MAX(date) FROM nav_history WHERE fund_code = ?", (fund_code,))) as cursor:
+        last_date = cursor.fetchone()[0]
+
+    return synced_start_date, last_date
+
+
+def save_nav_list(conn: sqlite3.Connection, fund_code: str, start_date: str,
+                  nav_list: "AssetNetworkSeries") -> None:
+    """
+    保存一段日期范围内的净值, 已存在的日期会被覆盖
+
+    Args:
+        conn: 数据库连接
+        fund_code: 基金代码
+        start_date: 本次同步的开始日期, 用于记录已同步的范围
+        nav_list: 净值序列
+    """
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO nav_history (fund_code, date, net_asset_value) VALUES (?, ?, ?)",
+            [(fund_code, date, net_asset_value)
+             for date, net_asset_value in zip(nav_list.date_strings(), nav_list.net_asset_values.tolist())]
+        )
+        conn.execute(
+            "INSERT INTO fund_sync (fund_code, synced_start_date) VALUES (?, ?) "
+            "ON CONFLICT(fund_code) DO UPDATE SET synced_start_date = MIN(synced_start_date, excluded.synced_start_date)",
+            (fund_code, start_date)
+        )
+
+
+def query_nav_list(conn: sqlite3.Connection, fund_code: str, start_date: str, end_date: str,
+                   limit: int) -> "AssetNetworkSeries":
+    """
+    查询一段日期范围内的净值, 和接口返回的顺序一致, 按照日期倒序
+
+    Args:
+        conn: 数据库连接
+        fund_code: 基金代码
+        start_date: 开始日期
+        end_date: 结束日期
+        limit: 最多返回的条数
+
+    Returns:
+        净值序列
+    """
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+    with closing(conn.execute(
+            "SELECT date, net_asset_value FROM nav_history "
+            "WHERE fund_code = ? AND date >= ? AND date <= ? ORDER BY date DESC LIMIT ?",
+            (fund_code, start_date, end_date, limit))) as cursor:
+        row_list = cursor.fetchall()
+    return AssetNetworkSeries([date for date, _ in row_list], [net_asset_value for _, net_asset_value in row_list])
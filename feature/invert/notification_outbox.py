@@ -0,0 +1,309 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from feature.invert import fang_tang_push
+
+# 默认的发件箱文件
+DEFAULT_OUTBOX_PATH = "fang_tang_outbox.db"
+# 每个 send_key 每天最多推送的次数, Server酱 免费版每天 5 条
+DEFAULT_DAILY_QUOTA = 5
+# 推送失败后最多尝试的次数, 超过后标记为失败, 不再重试
+MAX_ATTEMPTS = 8
+# 第一次重试前等待的时间, 单位秒, 之后每次翻倍
+RETRY_BASE_DELAY = 30
+# 重试前最多等待的时间, 单位秒
+RETRY_MAX_DELAY = 60 * 60
+# 后台推送最多等待下一次重试的时间, 单位秒, 超过后退出, 剩下的消息下次入队或者手动 flush 时推送
+BACKGROUND_MAX_WAIT = 5 * 60
+# 数据库连接的等待锁超时时间, 单位秒
+CONNECT_TIMEOUT = 30
+# 合并多条消息时每条之间的分隔
+MESSAGE_SEPARATOR = "\n\n---\n\n"
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+_CREATE_TABLE_SQL_LIST = [
+    # 待推送和已推送的消息
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        send_key TEXT NOT NULL,
+        title TEXT NOT NULL,
+        desp TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        sent_at REAL,
+        last_error TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, send_key, next_attempt_at)",
+    # 每次可能已经送达的推送请求, 用于计算每天的额度, 合并的多条消息只算一次
+    """
+    CREATE TABLE IF NOT EXISTS push_log (
+        send_key TEXT NOT NULL,
+        day TEXT NOT NULL,
+        sent_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS push_log_day ON push_log (send_key, day)",
+]
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    推送失败后下一次重试前等待的时间
+
+    Args:
+        attempts: 已经失败的次数, 从 1 开始
+
+    Returns:
+        等待时间, 单位秒
+    """
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def coalesce_messages(message_list: List[Tuple[str, str]]) -> Tuple[str, str]:
+    """
+    把同一个 send_key 的多条消息合并为一次推送
+
+    Args:
+        message_list: (标题, 内容) 列表, 按照入队顺序
+
+    Returns:
+        (标题, 内容), 只有一条时保持不变
+    """
+    if len(message_list) == 1:
+        return message_list[0]
+    title = f"{message_list[0][0].strip()} 等 {len(message_list)} 条通知"
+    desp = MESSAGE_SEPARATOR.join(f"## {item_title.strip()}\n\n{item_desp}"
+                                  for item_title, item_desp in message_list)
+    return title, desp
+
+
+class NotificationOutbox:
+    """
+    方糖推送的发件箱
+
+    消息先写入本地 SQLite, 入队后立即返回, 由后台线程推送, 进程退出前会等待推送完成。
+    同一个 send_key 的多条待推送消息合并为一次推送, 每天的推送次数不超过 daily_quota, 超出的留到第二天。
+    推送失败或者返回的 code 不为 0 时按照指数退避重试, 进程中途退出时消息仍然保存在发件箱中, 下次入队或者 flush 时推送。
+    重试只由发件箱负责, 每次尝试只发送一次请求; 请求出错时服务器可能已经推送, 也计入当天的额度。
+    """
+
+    def __init__(self, outbox_path: str = DEFAULT_OUTBOX_PATH, daily_quota: int = DEFAULT_DAILY_QUOTA):
+        # 发件箱文件路径
+        self._outbox_path = outbox_path
+        # 每个 send_key 每天最多推送的次数
+        self._daily_quota = daily_quota
+        # 同一时间只有一个线程推送, 避免重复推送
+        self._flush_lock = threading.Lock()
+        # 后台推送线程
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        folder = os.path.dirname(outbox_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            for create_sql in _CREATE_TABLE_SQL_LIST:
+                conn.execute(create_sql)
+
+    @property
+    def outbox_path(self) -> str:
+        return self._outbox_path
+
+    @property
+    def daily_quota(self) -> int:
+        return self._daily_quota
+
+    def enqueue(self, send_key: str, title: str, desp: str = "", flush: bool = True) -> int:
+        """
+        消息加入发件箱
+
+        Args:
+            send_key: Server酱 的 send_key
+            title: 标题
+            desp: 内容
+            flush: 是否立即在后台推送
+
+        Returns:
+            消息 id
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            message_id = conn.execute(
+                "INSERT INTO outbox (send_key, title, desp, created_at, status, next_attempt_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (send_key, title, desp, now, STATUS_PENDING, now)).lastrowid
+        if flush:
+            self.flush_in_background()
+        return message_id
+
+    def flush_in_background(self) -> threading.Thread:
+        """
+        启动后台推送线程, 已经在推送时不重复启动
+
+        线程不是守护线程, 进程退出前会等待推送完成, 下一次重试需要等待超过 BACKGROUND_MAX_WAIT 时退出
+
+        Returns:
+            推送线程
+        """
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._flush_until_idle, name="fang-tang-outbox")
+                self._thread.start()
+            return self._thread
+
+    def flush(self) -> Dict[str, int]:
+        """
+        推送所有到期的消息, 每个 send_key 合并为一次推送
+
+        Returns:
+            推送结果统计, sent: 推送成功的消息数, retry: 等待重试的消息数, failed: 不再重试的消息数,
+            deferred: 超出每天额度留到第二天的消息数
+        """
+        summary = {"sent": 0, "retry": 0, "failed": 0, "deferred": 0}
+        with self._flush_lock:
+            now = time.time()
+            with closing(self._connect()) as conn:
+                row_list = conn.execute(
+                    "SELECT id, send_key, title, desp, attempts FROM outbox "
+                    "WHERE status = ? AND next_attempt_at <= ? ORDER BY id", (STATUS_PENDING, now)).fetchall()
+                message_dict: Dict[str, list] = {}
+                for row in row_list:
+                    message_dict.setdefault(row[1], []).append(row)
+                for send_key, message_list in message_dict.items():
+                    for key, count in self._push(conn, send_key, message_list).items():
+                        summary[key] += count
+        return summary
+
+    def status(self) -> Dict[str, int]:
+        """
+        发件箱中各个状态的消息数
+
+        Returns:
+            状态 -> 消息数
+        """
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def next_attempt_delay(self) -> Optional[float]:
+        """
+        距离下一条待推送消息到期的时间
+
+        Returns:
+            等待时间, 单位秒, 没有待推送的消息时为 None
+        """
+        with closing(self._connect()) as conn:
+            next_attempt_at = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?",
+                                           (STATUS_PENDING,)).fetchone()[0]
+        return None if next_attempt_at is None else max(next_attempt_at - time.time(), 0)
+
+    def _push(self, conn: sqlite3.Connection, send_key: str, message_list: list) -> Dict[str, int]:
+        """推送同一个 send_key 的消息, 返回 flush 结果统计中各项增加的消息数"""
+        id_list = [row[0] for row in message_list]
+        placeholder = ", ".join("?" * len(id_list))
+        now = datetime.now()
+        day = now.strftime("%Y-%m-%d")
+        used_count = conn.execute("SELECT COUNT(*) FROM push_log WHERE send_key = ? AND day = ?",
+                                  (send_key, day)).fetchone()[0]
+        if used_count >= self._daily_quota:
+            tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            with conn:
+                conn.execute(f"UPDATE outbox SET next_attempt_at = ? WHERE id IN ({placeholder})",
+                             [tomorrow.timestamp(), *id_list])
+            print(f"{send_key[:8]}... 今天已经推送 {used_count} 次, {len(id_list)} 条消息留到明天推送")
+            return {"deferred": len(id_list)}
+
+        import requests
+
+        title, desp = coalesce_messages([(row[2], row[3]) for row in message_list])
+        try:
+            # 由发件箱按照退避时间重试, lcn_http 不再重试, 每次尝试只发送一次请求
+            response = fang_tang_push.sc_send(send_key, title, desp, max_retries=0)
+        except requests.RequestException as e:
+            # 连接中断或者超时的请求可能已经被推送, 服务器不会去重, 按照已经推送计入额度
+            with conn:
+                self._log_push(conn, send_key, day)
+            return self._mark_failed(conn, message_list, e)
+        except Exception as e:
+            # 例如 send_key 格式错误, 没有发出请求
+            return self._mark_failed(conn, message_list, e)
+        if response.get("code") != 0:
+            # 服务器明确拒绝, 没有推送, 不计入额度
+            return self._mark_failed(conn, message_list,
+                                     RuntimeError(f"code {response.get('code')}: {response.get('message')}"))
+
+        with conn:
+            conn.execute(f"UPDATE outbox SET status = ?, sent_at = ?, attempts = attempts + 1, last_error = NULL "
+                         f"WHERE id IN ({placeholder})", [STATUS_SENT, time.time(), *id_list])
+            self._log_push(conn, send_key, day)
+        print(f"推送成功: {title.strip()}")
+        return {"sent": len(id_list)}
+
+    @staticmethod
+    def _log_push(conn: sqlite3.Connection, send_key: str, day: str) -> None:
+        conn.execute("INSERT INTO push_log (send_key, day, sent_at) VALUES (?, ?, ?)", (send_key, day, time.time()))
+
+    @staticmethod
+    def _mark_failed(conn: sqlite3.Connection, message_list: list, error: Exception) -> Dict[str, int]:
+        count_dict = {"retry": 0, "failed": 0}
+        with conn:
+            for message_id, _, _, _, attempts in message_list:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    conn.execute("UPDATE outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                                 (STATUS_FAILED, attempts, str(error), message_id))
+                    count_dict["failed"] += 1
+                else:
+                    conn.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                                 (attempts, time.time() + retry_delay(attempts), str(error), message_id))
+                    count_dict["retry"] += 1
+        print(f"推送失败 {len(message_list)} 条消息: {error}")
+        return count_dict
+
+    def _flush_until_idle(self) -> None:
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"推送发件箱失败: {e}")
+                return
+            delay = self.next_attempt_delay()
+            if delay is None or delay > BACKGROUND_MAX_WAIT:
+                return
+            time.sleep(delay)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._outbox_path, timeout=CONNECT_TIMEOUT)
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    命令行入口, 推送发件箱中到期的消息并输出各个状态的消息数
+
+    Args:
+        argv: 命令行参数, 默认为 sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(prog="python -m feature.invert.notification_outbox", description="推送方糖发件箱")
+    parser.add_argument("-p", "--path", default=DEFAULT_OUTBOX_PATH, help=f"发件箱文件, 默认为 {DEFAULT_OUTBOX_PATH}")
+    parser.add_argument("-q", "--quota", type=int, default=DEFAULT_DAILY_QUOTA, help="每个 send_key 每天最多推送的次数")
+    parser.add_argument("-s", "--status", action="store_true", help="只输出状态, 不推送")
+    args = parser.parse_args(argv)
+
+    outbox = NotificationOutbox(args.path, args.quota)
+    if not args.status:
+        print(f"推送结果: {outbox.flush()}")
+    print(f"发件箱状态: {outbox.status()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,26 @@
-from typing import Optional, List
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import closing
+from typing import Optional, Iterable, Iterator, Tuple, TYPE_CHECKING
 
-import requests
-from bs4 import BeautifulSoup
+from base import lcn_http, lcn_time
+from feature.invert import fund_nav_store
 
-from base.clazz.asset_network_response import AssetNetworkResponse
+# lxml, numpy, requests 导入较慢, 在第一次使用时再导入, 让请求尽早发出
+if TYPE_CHECKING:
+    import requests
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+# 常量定义
+BASE_URL = "http://fund.eastmoney.com/f10/F10DataApi.aspx"
+# 默认的请求超时时间, 单位秒
+DEFAULT_TIMEOUT = 10
+# 东方财富接口单页最多返回 49 条数据, 超过的部分需要翻页
+MAX_PAGE_SIZE = 49
+# 批量回填时默认同时进行的请求数
+DEFAULT_MAX_WORKERS = 4
+
+_PAGE_COUNT_PATTERN = re.compile(r"pages:(\d+)")
 
 
 def request_fund_data_from_api(
@@ -12,8 +29,9 @@ def request_fund_data_from_api(
         end_date: str,
         data_type: str = "lsjz",
         page: int = 1,
-        per: int = 20
-) -> Optional[requests.Response]:
+        per: int = 20,
+        timeout: float = DEFAULT_TIMEOUT
+) -> Optional["requests.Response"]:
     """
     从东方财富 API 获取基金数据。
 
@@ -27,6 +45,7 @@ def request_fund_data_from_api(
         data_type (str, 可选): 要检索的数据类型。默认为 "lsjz" (可能是历史净值数据), 其他数据类型可能根据 API 的不同而有所不同。
         page (int, 可选): 分页的页码 (适用于大型数据集)。默认为 1。
         per (int, 可选): 每页的记录数。默认为 20。
+        timeout (float, 可选): 请求超时时间, 单位秒。默认为 DEFAULT_TIMEOUT。
 
     Returns:
         Optional[requests.Response]: 如果成功，则返回包含基金数据的 requests.Response 对象，否则返回 None。
@@ -35,7 +54,7 @@ def request_fund_data_from_api(
         requests.RequestException: 用于一般的网络或请求错误。
     """
 
-    url = (f"http://fund.eastmoney.com/f10/F10DataApi.aspx?"
+    url = (f"{BASE_URL}?"
            f"type={data_type}&code={fund_code}&page={page}&sdate={start_date}&edate={end_date}&per={per}")
 
     headers = {
@@ -43,8 +62,10 @@ def request_fund_data_from_api(
                       'Chrome/92.0.4515.131 Safari/537.36'
     }
 
+    import requests
+
     try:
-        response = requests.get(url=url, headers=headers)
+        response = lcn_http.get(url=url, headers=headers, timeout=timeout)
         response.raise_for_status()  # Raise an exception for non-200 status codes
         response.encoding = "utf-8"
         return response
@@ -53,58 +74,283 @@ def request_fund_data_from_api(
         return None
 
 
-def parse_fund_data_from_html_response(html_response: Optional[requests.Response]) -> List[AssetNetworkResponse]:
+def parse_fund_data_from_html_response(html_response: Optional["requests.Response"]) -> "AssetNetworkSeries":
     """
     解析包含资产净值信息的 HTML 响应。
 
-    该函数从 HTML 响应中提取表格数据，并将其转换为 AssetNetworkResponse 对象列表。
-    它使用 BeautifulSoup 解析 HTML，查找 <tr> (表格行) 和 <td> (表格单元格) 标签。
+    该函数从 HTML 响应中提取表格数据，并将其转换为 AssetNetworkSeries 净值序列。
+    响应是包含表格 HTML 的 JavaScript 片段, 只截取 <table> 部分交给 lxml 解析，查找 <tr> (表格行) 和 <td> (表格单元格) 标签。
 
     Args:
         html_response (requests.Response): 包含 HTML 内容的 requests 响应对象。
 
     Returns:
-        List[AssetNetworkResponse]: AssetNetworkResponse 对象列表，包含解析后的资产净值数据。
-        如果 HTML 响应无效或解析过程中发生错误，则返回一个空列表。
+        AssetNetworkSeries: 净值序列，包含解析后的资产净值数据。
+        如果 HTML 响应无效或解析过程中发生错误，则返回一个空序列。
     """
 
+    import lxml.html
+    import numpy as np
+    from lxml import etree
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
     if not html_response or not html_response.text:
-        return []
+        return AssetNetworkSeries([], [])
+
+    text = html_response.text
+    table_start = text.find("<table")
+    table_end = text.rfind("</table>")
+    if table_start != -1 and table_end > table_start:
+        text = text[table_start:table_end + len("</table>")]
 
-    soup = BeautifulSoup(html_response.text, 'html.parser')
-    table_rows = soup.find_all("tr")
-    responses = []
+    try:
+        root = lxml.html.fromstring(text)
+    except etree.ParserError:
+        return AssetNetworkSeries([], [])
+
+    table_rows = list(root.iter("tr"))
+    date_list = []
+    net_asset_value_list = []
 
     for row in table_rows[1:]:
         try:
-            columns = row.find_all("td")
+            columns = list(row.iter("td"))
             if len(columns) < 2:
                 continue  # Skip rows with insufficient data
 
-            date = columns[0].text.strip()
-            net_asset_value = float(columns[1].text.strip())
-            responses.append(AssetNetworkResponse(
-                date=date,
-                net_asset_value=net_asset_value
-            ))
+            date = np.datetime64(columns[0].text_content().strip(), 'D')
+            net_asset_value = float(columns[1].text_content().strip())
+            date_list.append(date)
+            net_asset_value_list.append(net_asset_value)
         except (IndexError, ValueError) as e:
-            print(f"Error parsing row: {row}, {e}")
-    return responses
+            print(f"Error parsing row: {lxml.html.tostring(row, encoding='unicode')}, {e}")
+    return AssetNetworkSeries(date_list, net_asset_value_list)
+
+
+def parse_page_count_from_html_response(html_response: Optional["requests.Response"]) -> int:
+    """
+    解析接口返回的总页数。
+
+    Args:
+        html_response (requests.Response): 包含 HTML 内容的 requests 响应对象。
+
+    Returns:
+        int: 总页数, 响应无效时返回 0。
+    """
+    if not html_response or not html_response.text:
+        return 0
+    match = _PAGE_COUNT_PATTERN.search(html_response.text)
+    return int(match.group(1)) if match else 1
+
+
+def fetch_fund_page(fund_code: str, start_date: str, end_date: str, page: int, per: int = MAX_PAGE_SIZE,
+                    timeout: float = DEFAULT_TIMEOUT) -> Tuple["AssetNetworkSeries", int]:
+    """
+    请求并解析一页基金数据。
+
+    Args:
+        fund_code: 基金代码。
+        start_date: 数据范围的开始日期。
+        end_date: 数据范围的结束日期。
+        page: 页码, 从 1 开始。
+        per: 每页的记录数。
+        timeout: 请求超时时间, 单位秒。
+
+    Returns:
+        (净值序列, 总页数), 日期范围内没有数据时为 (空序列, 0)。
+
+    Raises:
+        RuntimeError: 请求失败, 或者不是最后一页但是数据不满一页。
+    """
+    response = request_fund_data_from_api(fund_code, start_date, end_date, "lsjz", page, per, timeout)
+    if response is None:
+        raise RuntimeError(f"Failed to fetch page {page} of fund {fund_code}")
+    rows, page_count = parse_fund_data_from_html_response(response), parse_page_count_from_html_response(response)
+    # 中间的页缺少数据时, 拼接后的净值会有空洞, 每日差额会跨过缺少的日期
+    if page < page_count and len(rows) < per:
+        raise RuntimeError(f"Page {page} of fund {fund_code} has {len(rows)} rows, expected {per}")
+    return rows, page_count
+
+
+def backfill_fund_data(
+        fund_code_list: Iterable[str],
+        start_date: str,
+        end_date: str,
+        per: int = MAX_PAGE_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT
+) -> Iterator[Tuple[str, "AssetNetworkSeries"]]:
+    """
+    批量回填多个基金在日期范围内的全部净值。
+
+    所有基金和分页共用一个线程池, 同时进行的请求数不超过 max_workers。先请求每个基金的第一页得到总页数,
+    再并发请求剩余的页。每页返回后立即按日期去重并输出, 不需要等待全部请求完成。
+    任意一页失败时抛出异常并取消剩余的请求, 不会输出缺页的数据。
+
+    Args:
+        fund_code_list: 基金代码列表。
+        start_date: 数据范围的开始日期。
+        end_date: 数据范围的结束日期。
+        per: 每页的记录数, 不超过 MAX_PAGE_SIZE。
+        max_workers: 同时进行的最大请求数。
+        timeout: 请求超时时间, 单位秒。
+
+    Returns:
+        按返回顺序输出的 (基金代码, 本批新增的净值序列)。
 
+    Raises:
+        RuntimeError: 任意一页请求失败或者数据不完整。
+    """
+    import numpy as np
+
+    per = min(per, MAX_PAGE_SIZE)
+    seen_date_dict = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending_dict = {}
+        for fund_code in dict.fromkeys(fund_code_list):
+            seen_date_dict[fund_code] = set()
+            future = executor.submit(fetch_fund_page, fund_code, start_date, end_date, 1, per, timeout)
+            pending_dict[future] = (fund_code, 1)
+
+        while pending_dict:
+            done_set, _ = wait(pending_dict, return_when=FIRST_COMPLETED)
+            for future in done_set:
+                fund_code, page = pending_dict.pop(future)
+                rows, page_count = future.result()
+
+                # 第一页返回后才知道总页数, 再提交剩余的页
+                if page == 1:
+                    for next_page in range(2, page_count + 1):
+                        next_future = executor.submit(fetch_fund_page, fund_code, start_date, end_date, next_page,
+                                                      per, timeout)
+                        pending_dict[next_future] = (fund_code, next_page)
+
+                # 日期按天数保存, 同一页内重复的日期也只保留第一条
+                seen_date_set = seen_date_dict[fund_code]
+                new_mask = np.zeros(len(rows), dtype=bool)
+                for index, day_number in enumerate(rows.dates.astype(np.int64).tolist()):
+                    if day_number not in seen_date_set:
+                        seen_date_set.add(day_number)
+                        new_mask[index] = True
+                if new_mask.any():
+                    yield fund_code, rows[new_mask]
+    finally:
+        # 调用方提前结束迭代时, 取消还没有开始的请求
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_fund_history(fund_code: str, start_date: str, end_date: str, max_workers: int = DEFAULT_MAX_WORKERS,
+                       timeout: float = DEFAULT_TIMEOUT) -> "AssetNetworkSeries":
+    """
+    请求基金在日期范围内的全部净值, 自动翻页。
+
+    Args:
+        fund_code: 基金代码。
+        start_date: 数据范围的开始日期。
+        end_date: 数据范围的结束日期。
+        max_workers: 同时进行的最大请求数。
+        timeout: 请求超时时间, 单位秒。
+
+    Returns:
+        按日期倒序的净值序列, 和接口返回的顺序一致。
+
+    Raises:
+        RuntimeError: 任意一页请求失败或者数据不完整。
+    """
+    from base.clazz.asset_network_series import AssetNetworkSeries
 
-def fetch_fund_data(fund_code: str, show_count: int, start_date: str, end_date: str) -> List[AssetNetworkResponse]:
+    history_list = [rows for _, rows in backfill_fund_data([fund_code], start_date, end_date,
+                                                           max_workers=max_workers, timeout=timeout)]
+    return AssetNetworkSeries.concatenate(history_list).sort_by_date(reverse=True)
+
+
+def fetch_fund_data(fund_code: str, show_count: int, start_date: str, end_date: str,
+                    timeout: float = DEFAULT_TIMEOUT, store_path: Optional[str] = None) -> "AssetNetworkSeries":
     """
     请求并解析基金数据。
 
+    指定 store_path 时先增量同步到本地净值存储, 再从本地读取数据, 同步失败时抛出异常, 不会把本地旧的数据当作最新的数据。
+    需要翻页时任意一页失败都会抛出异常, 不会返回缺页的数据。
+
     Args:
         fund_code: 基金代码。
         show_count: 需要获取的数据点数量。
         start_date: 数据范围的开始日期。
         end_date: 数据范围的结束日期。
+        timeout: 请求超时时间, 单位秒。
+        store_path: 本地净值存储的文件路径, 为 None 时直接请求接口。
 
     Returns:
-        AssetNetworkResponse 对象的列表。
+        按日期倒序的净值序列。
+
+    Raises:
+        RuntimeError: 同步本地净值存储失败, 或者需要翻页时任意一页请求失败或者数据不完整。
     """
-    need_page_num = 1
-    response = request_fund_data_from_api(fund_code, start_date, end_date, "lsjz", need_page_num, show_count)
-    return parse_fund_data_from_html_response(response)
+    if store_path:
+        with closing(fund_nav_store.open_store(store_path)) as conn:
+            sync_fund_data(conn, fund_code, start_date, end_date, timeout)
+            return fund_nav_store.query_nav_list(conn, fund_code, start_date, end_date, show_count)
+
+    if show_count <= MAX_PAGE_SIZE:
+        # 最新的数据在第一页, 一页足够时只请求一次
+        need_page_num = 1
+        response = request_fund_data_from_api(fund_code, start_date, end_date, "lsjz", need_page_num, show_count,
+                                              timeout)
+        return parse_fund_data_from_html_response(response)
+    return fetch_fund_history(fund_code, start_date, end_date, timeout=timeout)[:show_count]
+
+
+def sync_fund_data(conn, fund_code: str, start_date: str, end_date: str, timeout: float = DEFAULT_TIMEOUT) -> None:
+    """
+    增量同步基金净值到本地存储。
+
+    只请求本地还没有的日期: 早于已同步的最早日期的部分, 以及最后一条净值之后的部分。
+    请求失败的范围不记录为已同步, 其他范围仍然保存, 全部请求结束后再抛出异常。
+
+    Args:
+        conn: 本地净值存储的数据库连接。
+        fund_code: 基金代码。
+        start_date: 需要的开始日期。
+        end_date: 需要的结束日期。
+        timeout: 请求超时时间, 单位秒。
+
+    Raises:
+        RuntimeError: 任意一个范围同步失败, 本地数据不是最新的。
+    """
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+    synced_start_date, last_date = fund_nav_store.get_synced_range(conn, fund_code)
+
+    if synced_start_date is None:
+        sync_range_list = [(start_date, end_date)]
+    else:
+        sync_range_list = []
+        if start_date < synced_start_date:
+            sync_range_list.append((start_date, lcn_time.add_days(synced_start_date, -1)))
+        # 当天的净值可能还没有公布, 所以从最后一条净值的下一天开始请求, 而不是上次请求的结束日期
+        sync_start_date = lcn_time.add_days(last_date, 1) if last_date else synced_start_date
+        if sync_start_date <= end_date:
+            sync_range_list.append((sync_start_date, end_date))
+
+    failed_range_list = []
+    for range_start_date, range_end_date in sync_range_list:
+        try:
+            rows, page_count = fetch_fund_page(fund_code, range_start_date, range_end_date, 1, timeout=timeout)
+            page_result_list = []
+            if page_count > 1:
+                with ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS) as executor:
+                    page_result_list = list(executor.map(
+                        lambda page: fetch_fund_page(fund_code, range_start_date, range_end_date, page,
+                                                     timeout=timeout),
+                        range(2, page_count + 1)))
+        except RuntimeError as e:
+            # 请求失败不记录同步范围, 下次重新请求
+            failed_range_list.append(f"{range_start_date} ~ {range_end_date}: {e}")
+            continue
+        rows = AssetNetworkSeries.concatenate([rows] + [page_rows for page_rows, _ in page_result_list])
+        fund_nav_store.save_nav_list(conn, fund_code, range_start_date, rows)
+
+    if failed_range_list:
+        raise RuntimeError(f"Failed to sync fund {fund_code} {'; '.join(failed_range_list)}")
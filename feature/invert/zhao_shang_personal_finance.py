@@ -1,56 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from typing import TYPE_CHECKING
 
-import bs4
-import requests
+from base import lcn_http
 
-from base.clazz.asset_network_response import AssetNetworkResponse
+# lxml, numpy, requests 导入较慢, 在第一次使用时再导入, 让请求尽早发出
+if TYPE_CHECKING:
+    from base.clazz.asset_network_series import AssetNetworkSeries
 
 # 常量定义
 BASE_URL = "https://www.cmbchina.com/cfweb/personal/saproductdetail.aspx"
-URL_TEMPLATE = f"{BASE_URL}?saacod=D07&funcod={{code}}&type=prodvalue&PageNo=1#toTarget"
-
-
-def fetch_personal_finance_data(product_code: str, num_entries: int) -> List[AssetNetworkResponse]:
+URL_TEMPLATE = f"{BASE_URL}?saacod=D07&funcod={{code}}&type=prodvalue&PageNo={{page_no}}#toTarget"
+# 默认的请求超时时间, 单位秒
+DEFAULT_TIMEOUT = 10
+# 招商一页的数据条数
+PAGE_SIZE = 10
+# 多页请求时同时进行的最大请求数
+DEFAULT_MAX_WORKERS = 4
+# 产品净值表格, 等价于 CSS 选择器 #cList .ProductTable
+PRODUCT_TABLE_XPATH = '//*[@id="cList"]//*[contains(concat(" ", normalize-space(@class), " "), " ProductTable ")]'
+
+
+def fetch_personal_finance_data(product_code: str, num_entries: int,
+                                timeout: float = DEFAULT_TIMEOUT) -> "AssetNetworkSeries":
     """
     获取个人金融数据
+
+    一页只有 PAGE_SIZE 条数据, 需要的条数超过一页时按需并发请求多页, 按页码顺序拼接,
+    数据足够或者遇到不满一页的最后一页时停止
     Args:
         product_code: 产品代码
         num_entries: 需要返回的记录数量
+        timeout: 请求超时时间, 单位秒
     Returns:
-        包含金融数据的 AssetNetworkResponse 对象列表
+        包含金融数据的净值序列
+    """
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+    page_count = max(1, -(-num_entries // PAGE_SIZE))
+    if page_count == 1:
+        return fetch_personal_finance_page(product_code, 1, timeout)[:num_entries]
+
+    page_results_list = []
+    with ThreadPoolExecutor(max_workers=min(page_count, DEFAULT_MAX_WORKERS)) as executor:
+        future_list = [executor.submit(fetch_personal_finance_page, product_code, page_no, timeout)
+                       for page_no in range(1, page_count + 1)]
+        try:
+            for future in future_list:
+                page_results = future.result()
+                page_results_list.append(page_results)
+                if sum(map(len, page_results_list)) >= num_entries or len(page_results) < PAGE_SIZE:
+                    break
+        finally:
+            # 数据已经足够或者出错时, 取消还没有开始的请求
+            for future in future_list:
+                future.cancel()
+
+    return AssetNetworkSeries.concatenate(page_results_list)[:num_entries]
+
+
+def fetch_personal_finance_page(product_code: str, page_no: int,
+                                timeout: float = DEFAULT_TIMEOUT) -> "AssetNetworkSeries":
     """
-    url = URL_TEMPLATE.format(code=product_code)
+    获取一页个人金融数据
+    Args:
+        product_code: 产品代码
+        page_no: 页码, 从 1 开始
+        timeout: 请求超时时间, 单位秒
+    Returns:
+        该页的净值序列
+    """
+    import requests
+
+    url = URL_TEMPLATE.format(code=product_code, page_no=page_no)
     try:
-        response = requests.get(url)
+        response = lcn_http.get(url, timeout=timeout)
         response.raise_for_status()
     except requests.RequestException as e:
         raise RuntimeError(f"Failed to fetch data from {url}: {e}")
 
-    soup = bs4.BeautifulSoup(response.text, 'lxml')
+    return parse_personal_finance_html(response.text)
+
+
+def parse_personal_finance_html(html: str) -> "AssetNetworkSeries":
+    """
+    解析一页个人金融数据的 HTML
+
+    只定位一次产品表格, 然后按顺序遍历表格的行, 不需要每一行都重新搜索整个文档
+    Args:
+        html: 页面 HTML
+    Returns:
+        该页的净值序列
+    """
+    import lxml.html
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+    tree = lxml.html.fromstring(html)
+    table_list = tree.xpath(PRODUCT_TABLE_XPATH)
+    if not table_list:
+        return AssetNetworkSeries([], [])
 
-    # 今天日期从第二行开始, 只计算需要的天数的
-    start_index = 2
-    # 这里有个问题, 招商一页 10 条数据, 可能一页的条数不够, 先这样
-    end_index = start_index + num_entries
+    # 今天日期从第二行开始, 第一行为表头
+    row_list = table_list[0].xpath("./tr | ./tbody/tr")[1:PAGE_SIZE + 1]
 
-    results = []
-    for i in range(start_index, end_index):
-        row_selector = f'#cList .ProductTable tr:nth-child({i}) td'
-        row_data = soup.select(row_selector)
+    date_list = []
+    net_asset_value_list = []
+    for i, row in enumerate(row_list, start=2):
+        row_data = row.xpath(".//td")
 
         if len(row_data) < 5:  # 检查是否有足够的列
             break
 
         try:
-            results.append(AssetNetworkResponse(
-                date=convert_date_format(clean_whitespace(row_data[4].text)),
-                net_asset_value=float(clean_whitespace(row_data[3].text))
-            ))
+            date = convert_date_format(clean_whitespace(row_data[4].text_content()))
+            net_asset_value = float(clean_whitespace(row_data[3].text_content()))
         except (ValueError, IndexError) as e:
             raise RuntimeError(f"Error parsing row {i}: {e}")
+        date_list.append(date)
+        net_asset_value_list.append(net_asset_value)
 
-    return results
+    return AssetNetworkSeries(date_list, net_asset_value_list)
 
 
 def clean_whitespace(content: str) -> str:
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from feature.kaipanla_zhibo_data import MARKET_TIMEZONE, LiveFeedPoller, MultiFeedMonitor, SEEN_COMMENTS_PATH, \
+    CommentDeduplicator, load_feed_config, stdout_sink, tagged_stdout_sink
+
+# 评论归档的数据库文件
+DEFAULT_ARCHIVE_PATH = "kaipanla_comments.db"
+# 缓存的评论达到该数量时写入数据库
+DEFAULT_BATCH_SIZE = 200
+# 缓存的评论最多等待的时间, 单位秒, 由定时器写入, 进程被强制结束时最多丢失这段时间内的评论
+DEFAULT_FLUSH_INTERVAL = 5.0
+# trigram 分词的最短关键词长度, 更短的关键词在时间范围内逐条匹配
+TRIGRAM_MIN_LENGTH = 3
+# 输入时间支持的格式, 只有日期时表示当天的开始或者结束
+DATETIME_FORMAT_LIST = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS comment (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    source TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comment_created_at ON comment (created_at);
+CREATE INDEX IF NOT EXISTS comment_day ON comment (day, created_at);
+"""
+# 全文索引只保存倒排表, 内容引用 comment 表, 归档只追加, 插入评论时同步写入索引
+FTS_SCHEMA_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS comment_fts USING fts5 (
+    content, content='comment', content_rowid='id', tokenize='trigram'
+);
+"""
+
+
+class ArchivedComment(NamedTuple):
+    """归档的评论"""
+    created_at: datetime
+    source: str
+    content: str
+
+
+def parse_datetime(value: str, end: bool = False) -> datetime:
+    """
+    解析命令行输入的时间, 按照交易所时区处理
+
+    Args:
+        value: yyyy-mm-dd [HH:MM[:SS]] 格式的字符串
+        end: 只有日期时是否表示当天结束
+
+    Returns:
+        带时区的时间
+    """
+    for datetime_format in DATETIME_FORMAT_LIST:
+        try:
+            parsed = datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+        if end and datetime_format == "%Y-%m-%d":
+            parsed += timedelta(days=1)
+        return parsed.replace(tzinfo=MARKET_TIMEZONE)
+    raise ValueError(f"unsupported time {value}, use yyyy-mm-dd [HH:MM[:SS]]")
+
+
+class CommentArchive:
+    """
+    直播评论归档, 保存在 SQLite 中, 只追加不修改
+
+    评论按照时间和交易日建立索引, 按照时间范围或者某一天回放时只读取对应的部分;
+    SQLite 支持时使用 trigram 分词的 FTS5 全文索引, 任意位置的中文关键词都可以直接命中。
+    对象本身可以作为 LiveFeedPoller 的输出, 评论先缓存, 达到 batch_size 或者第一条缓存的评论等待 flush_interval 秒后
+    在一个事务中写入, 之后没有新评论也会按时写入。
+    查询使用单独的只读连接逐行返回, 不会把结果全部读入内存, 监控写入时也可以查询。
+    """
+
+    def __init__(self, db_path: str = DEFAULT_ARCHIVE_PATH, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        # 数据库文件路径
+        self._db_path = db_path
+        # 缓存的评论达到该数量时写入
+        self._batch_size = batch_size
+        # 缓存的评论最多等待的时间
+        self._flush_interval = flush_interval
+        # 等待写入的 (时间戳, 交易日, 来源, 内容)
+        self._pending_list: List[Tuple[float, str, str, str]] = []
+        # 有缓存的评论时等待 flush_interval 后写入的定时器
+        self._flush_timer: Optional[threading.Timer] = None
+        # 是否已经关闭
+        self._closed = False
+        self._lock = threading.Lock()
+        # 输出在线程中执行, 写入连接由锁保护
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL 模式下查询不会阻塞写入
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA_SQL)
+        # 是否有全文索引
+        self._has_fts = self._create_fts()
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path
+
+    @property
+    def has_fts(self) -> bool:
+        return self._has_fts
+
+    def __call__(self, source: str, comments: List[str]) -> None:
+        """作为 LiveFeedPoller 的输出"""
+        self.append(source, comments)
+
+    def append(self, source: str, comments: List[str], created_at: Optional[datetime] = None) -> None:
+        """
+        追加评论, 达到批量大小时立即写入数据库, 否则最多等待 flush_interval 秒后写入
+
+        Args:
+            source: 来源
+            comments: 评论列表
+            created_at: 评论时间, 默认为当前时间
+        """
+        created_at = (created_at or datetime.now(MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+        timestamp, day = created_at.timestamp(), created_at.strftime("%Y-%m-%d")
+        with self._lock:
+            self._pending_list.extend((timestamp, day, source, comment) for comment in comments)
+            if len(self._pending_list) >= self._batch_size:
+                self._flush()
+            elif self._pending_list and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self._flush_interval, self._flush_on_timer)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self) -> None:
+        """写入所有缓存的评论"""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """写入缓存的评论并关闭数据库"""
+        with self._lock:
+            if self._closed:
+                return
+            self._flush()
+            self._closed = True
+            self._connection.close()
+
+    def __enter__(self) -> 'CommentArchive':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def search(self, keyword: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+               source: Optional[str] = None, limit: Optional[int] = None) -> Iterator[ArchivedComment]:
+        """
+        按照关键词和时间范围查询评论, 按照时间顺序逐条返回
+
+        Args:
+            keyword: 关键词, 空格分隔的多个关键词需要同时出现, 为空时不限制
+            start: 开始时间, 包括
+            end: 结束时间, 不包括
+            source: 来源, 为空时不限制
+            limit: 最多返回的数量
+
+        Returns:
+            评论的迭代器
+        """
+        sql, parameter_list = self._build_search_sql(keyword, start, end, source, limit)
+        # 只读连接, 迭代过程中可以继续写入
+        connection = sqlite3.connect(f"file:{os.path.abspath(self._db_path)}?mode=ro", uri=True)
+        try:
+            for created_at, row_source, content in connection.execute(sql, parameter_list):
+                yield ArchivedComment(datetime.fromtimestamp(created_at, MARKET_TIMEZONE), row_source, content)
+        finally:
+            connection.close()
+
+    def replay(self, day: str, source: Optional[str] = None) -> Iterator[ArchivedComment]:
+        """
+        回放某一个交易日的评论
+
+        Args:
+            day: yyyy-mm-dd 格式的交易日
+            source: 来源, 为空时不限制
+
+        Returns:
+            评论的迭代器
+        """
+        return self.search(start=parse_datetime(day), end=parse_datetime(day, end=True), source=source)
+
+    def count(self) -> int:
+        """已经写入的评论数量"""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM comment").fetchone()[0]
+
+    def _build_search_sql(self, keyword, start, end, source, limit):
+        table = "comment"
+        condition_list, parameter_list = [], []
+        keyword_list = keyword.split() if keyword else []
+        fts_keyword_list = [word for word in keyword_list if self._has_fts and len(word) >= TRIGRAM_MIN_LENGTH]
+        if fts_keyword_list:
+            table = "comment JOIN comment_fts ON comment_fts.rowid = comment.id"
+            condition_list.append("comment_fts MATCH ?")
+            # 作为短语查询, 关键词中的引号需要转义
+            parameter_list.append(" AND ".join('"' + word.replace('"', '""') + '"' for word in fts_keyword_list))
+        for word in keyword_list:
+            if word not in fts_keyword_list:
+                condition_list.append("instr(comment.content, ?) > 0")
+                parameter_list.append(word)
+        if start is not None:
+            condition_list.append("comment.created_at >= ?")
+            parameter_list.append(start.timestamp())
+        if end is not None:
+            condition_list.append("comment.created_at < ?")
+            parameter_list.append(end.timestamp())
+        if source:
+            condition_list.append("comment.source = ?")
+            parameter_list.append(source)
+        sql = f"SELECT comment.created_at, comment.source, comment.content FROM {table}"
+        if condition_list:
+            sql += " WHERE " + " AND ".join(condition_list)
+        sql += " ORDER BY comment.created_at, comment.id"
+        if limit:
+            sql += " LIMIT ?"
+            parameter_list.append(limit)
+        return sql, parameter_list
+
+    def _create_fts(self) -> bool:
+        try:
+            self._connection.executescript(FTS_SCHEMA_SQL)
+        except sqlite3.OperationalError as e:
+            # SQLite 3.34 之前没有 trigram 分词, 关键词查询在时间范围内扫描
+            print(f"create full-text index failed, search by scanning: {e}")
+            return False
+        return True
+
+    def _flush_on_timer(self) -> None:
+        with self._lock:
+            # 定时器触发前可能已经因为达到批量大小写入, 或者已经关闭
+            if self._closed:
+                return
+            try:
+                self._flush()
+            except sqlite3.Error as e:
+                print(f"write comments to {self._db_path} failed, retry with the next comments: {e}")
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending_list:
+            return
+        with self._connection:
+            cursor = self._connection.cursor()
+            for row in self._pending_list:
+                cursor.execute("INSERT INTO comment (created_at, day, source, content) VALUES (?, ?, ?, ?)", row)
+                if self._has_fts:
+                    cursor.execute("INSERT INTO comment_fts (rowid, content) VALUES (?, ?)",
+                                   (cursor.lastrowid, row[3]))
+        self._pending_list = []
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    命令行入口, 查询归档的评论, 或者使用 --monitor 监控评论并归档
+
+    Args:
+        argv: 命令行参数, 默认为 sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(prog="python -m feature.kaipanla_comment_archive", description="查询开盘啦直播评论归档")
+    parser.add_argument("keyword", nargs="*", help="关键词, 多个关键词需要同时出现")
+    parser.add_argument("-d", "--db", default=DEFAULT_ARCHIVE_PATH, help=f"归档数据库, 默认为 {DEFAULT_ARCHIVE_PATH}")
+    parser.add_argument("-s", "--start", help="开始时间, yyyy-mm-dd [HH:MM[:SS]]")
+    parser.add_argument("-e", "--end", help="结束时间, 只有日期时包括当天")
+    parser.add_argument("--source", help="来源")
+    parser.add_argument("-n", "--limit", type=int, help="最多输出的数量")
+    parser.add_argument("-m", "--monitor", action="store_true", help="监控评论并写入归档")
+    parser.add_argument("-c", "--config", help="监控时多个接口的 JSON 配置文件")
+    args = parser.parse_args(argv)
+
+    with CommentArchive(args.db) as archive:
+        if args.monitor:
+            print("开始监控评论更新... (Ctrl+C 停止)")
+            try:
+                if args.config:
+                    with MultiFeedMonitor(load_feed_config(args.config), ".") as monitor:
+                        asyncio.run(monitor.run([tagged_stdout_sink, archive]))
+                else:
+                    with CommentDeduplicator(SEEN_COMMENTS_PATH) as seen:
+                        asyncio.run(LiveFeedPoller(seen=seen).run([stdout_sink, archive]))
+            except KeyboardInterrupt:
+                print("\n程序已停止")
+            return
+
+        start = parse_datetime(args.start) if args.start else None
+        end = parse_datetime(args.end, end=True) if args.end else None
+        count = 0
+        for comment in archive.search(" ".join(args.keyword), start, end, args.source, args.limit):
+            print(f"{comment.created_at:%Y-%m-%d %H:%M:%S} [{comment.source}] {' '.join(comment.content.splitlines())}")
+            count += 1
+        print(f"共 {count} 条评论")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,197 @@
+import argparse
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, time as datetime_time, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 import requests
-import time
 
-# 存储已出现过的评论，用于去重
-seen_comments = set()
+from base import lcn_file, lcn_http
+
 url = "https://apphwshhq.longhuvip.com/w1/api/index.php?PhoneOSNew=2&VerSion=5.19.0.3&a=ZhiBoContent&apiv=w40&c=ConceptionPoint"
 
+# 交易时间所在的时区, 中国没有夏令时, 固定为 UTC+8
+MARKET_TIMEZONE = timezone(timedelta(hours=8))
+# 交易时间段, 包括集合竞价
+MARKET_SESSION_LIST = [(datetime_time(9, 15), datetime_time(11, 30)), (datetime_time(13, 0), datetime_time(15, 0))]
+# 交易时间内的轮询间隔, 单位秒
+MARKET_INTERVAL = 2.0
+# 交易时间内没有新评论时的最大轮询间隔, 保证延迟不会太高
+MARKET_MAX_INTERVAL = 10.0
+# 非交易时间的轮询间隔
+OFF_MARKET_INTERVAL = 30.0
+# 非交易时间没有新评论时的最大轮询间隔
+OFF_MARKET_MAX_INTERVAL = 300.0
+# 刚出现新评论时的轮询间隔, 连续的新评论通常会集中出现
+BURST_INTERVAL = 1.0
+# 每次没有新评论或者请求失败后, 轮询间隔增加的倍数
+BACKOFF_FACTOR = 1.5
+# 请求超时时间, 单位秒
+DEFAULT_TIMEOUT = 10
+# 去重时最多记住的评论数, 超出时淘汰最久没有出现的评论
+DEFAULT_DEDUP_CAPACITY = 100000
+# 评论哈希的字节数, 10 万条评论的碰撞概率约为 3e-10
+COMMENT_DIGEST_SIZE = 8
+# 持久化的去重文件, 重启后不会重复输出
+SEEN_COMMENTS_PATH = "kaipanla_seen_comments.bin"
+# 多个接口时每个接口的去重文件名, 保存在 seen_folder 中
+SEEN_COMMENTS_FILE_NAME = "{source}_seen_comments.bin"
+
+# 输出新评论的函数, 参数为 (来源, 新评论列表), 可以是普通函数或者协程函数
+Sink = Callable[[str, List[str]], Union[None, Awaitable[None]]]
+
+
+class CommentDeduplicator:
+    """
+    评论去重, 只保存评论的 8 字节 blake2b 哈希, 按照 LRU 淘汰, 内存占用不会随运行时间增长
+
+    指定 file_path 时持久化到文件: 新评论的哈希追加写入文件, 启动时读取最近的 capacity 条,
+    文件超过 capacity 的两倍时重写为当前的内容。用法和 set 相同, 支持 in 和 add。
+    """
+
+    def __init__(self, file_path: Optional[str] = None, capacity: int = DEFAULT_DEDUP_CAPACITY):
+        # 持久化文件路径, 为 None 时只在内存中去重
+        self._file_path = file_path
+        # 最多记住的评论数
+        self._capacity = capacity
+        # 评论哈希, 最近出现的在最后
+        self._digest_dict = OrderedDict()
+        # 文件中的哈希数量, 包括已经淘汰的
+        self._file_digest_count = 0
+        # 追加写入的文件
+        self._file = None
+        self._lock = threading.Lock()
+        if file_path:
+            self._load()
+
+    @property
+    def file_path(self) -> Optional[str]:
+        return self._file_path
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return len(self._digest_dict)
+
+    def __contains__(self, comment: str) -> bool:
+        digest = self._digest(comment)
+        with self._lock:
+            if digest not in self._digest_dict:
+                return False
+            # 仍然在接口中出现的评论不会被淘汰
+            self._digest_dict.move_to_end(digest)
+            return True
+
+    def add(self, comment: str) -> None:
+        """
+        记录评论
+
+        Args:
+            comment: 评论内容
+        """
+        digest = self._digest(comment)
+        with self._lock:
+            if digest in self._digest_dict:
+                self._digest_dict.move_to_end(digest)
+                return
+            self._digest_dict[digest] = None
+            if len(self._digest_dict) > self._capacity:
+                self._digest_dict.popitem(last=False)
+            if self._file is not None:
+                self._file.write(digest)
+                self._file_digest_count += 1
+                if self._file_digest_count > 2 * self._capacity:
+                    self._compact()
+
+    def close(self) -> None:
+        """关闭持久化文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> 'CommentDeduplicator':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @staticmethod
+    def _digest(comment: str) -> bytes:
+        return hashlib.blake2b(comment.encode('utf-8'), digest_size=COMMENT_DIGEST_SIZE).digest()
+
+    def _load(self) -> None:
+        if os.path.exists(self._file_path):
+            with open(self._file_path, 'rb') as f:
+                content = f.read()
+            # 最后一条可能因为中途退出没有写完整, 忽略不完整的部分
+            count = len(content) // COMMENT_DIGEST_SIZE
+            for index in range(max(count - self._capacity, 0), count):
+                self._digest_dict[content[index * COMMENT_DIGEST_SIZE:(index + 1) * COMMENT_DIGEST_SIZE]] = None
+            self._file_digest_count = count
+            if count > self._capacity or len(content) % COMMENT_DIGEST_SIZE:
+                self._compact()
+                return
+        # 不使用缓冲, 每条评论立即写入文件, 中途退出也不会丢失
+        self._file = open(self._file_path, 'ab', buffering=0)
+
+    def _compact(self) -> None:
+        """把文件重写为当前记住的哈希"""
+        if self._file is not None:
+            self._file.close()
+        lcn_file.write_bytes_atomically(self._file_path, b"".join(self._digest_dict))
+        self._file_digest_count = len(self._digest_dict)
+        self._file = open(self._file_path, 'ab', buffering=0)
+
+
+# 存储已出现过的评论，用于去重
+seen_comments = CommentDeduplicator()
+
+
+def extract_new_comments(item_list: List[Dict[str, Any]], seen: Any) -> List[str]:
+    """
+    找出没有出现过的评论, 并记录为已出现
+
+    Args:
+        item_list: 接口返回的 List 字段
+        seen: 已出现过的评论, 支持 in 和 add
+
+    Returns:
+        新评论列表, 顺序和接口返回的一致
+    """
+    new_comments = []
+    for item in item_list:
+        comment = item.get('Comment', '')
+        if comment and comment not in seen:
+            new_comments.append(comment)
+            seen.add(comment)
+    return new_comments
+
+
 def fetch_new_comments():
     try:
-        response = requests.get(url, timeout=10)
+        response = lcn_http.get(url, timeout=DEFAULT_TIMEOUT)
         response.raise_for_status()  # 检查HTTP错误
-        
+
         data = response.json()
         if 'List' not in data:
             print("响应中未找到 'List' 字段")
             return
-        
-        new_comments = []
-        for item in data['List']:
-            comment = item.get('Comment', '')
-            if comment and comment not in seen_comments:
-                new_comments.append(comment)
-                seen_comments.add(comment)
-        
+
+        new_comments = extract_new_comments(data['List'], seen_comments)
+
         # 输出新评论（从旧到新）
         for comment in new_comments:
             print(comment)
-            
+
     except requests.exceptions.RequestException as e:
         print(f"请求失败: {e}")
     except ValueError:
@@ -33,11 +199,340 @@ def fetch_new_comments():
     except Exception as e:
         print(f"发生错误: {e}")
 
-if __name__ == "__main__":
+
+def is_market_time(now: Optional[datetime] = None) -> bool:
+    """
+    是否为 A 股交易时间, 只判断工作日, 不包括节假日
+
+    Args:
+        now: 时间, 默认为当前时间
+
+    Returns:
+        是否为交易时间
+    """
+    now = (now or datetime.now(MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+    if now.weekday() >= 5:
+        return False
+    return any(start <= now.time() <= end for start, end in MARKET_SESSION_LIST)
+
+
+def stdout_sink(source: str, comments: List[str]) -> None:
+    """输出到标准输出"""
+    for comment in comments:
+        print(comment)
+
+
+def tagged_stdout_sink(source: str, comments: List[str]) -> None:
+    """输出到标准输出, 每条评论带上来源"""
+    for comment in comments:
+        print(f"[{source}] {comment}")
+
+
+def build_feed_url(feed_url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    在接口地址上增加或者替换查询参数
+
+    Args:
+        feed_url: 接口地址
+        params: 查询参数
+
+    Returns:
+        新的接口地址
+    """
+    if not params:
+        return feed_url
+    parts = urlsplit(feed_url)
+    query_dict = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query_dict.update({key: str(value) for key, value in params.items()})
+    return urlunsplit(parts._replace(query=urlencode(query_dict)))
+
+
+def load_feed_config(config_path: str) -> List[Dict[str, Any]]:
+    """
+    读取多个接口的配置
+
+    配置文件为 JSON 数组, 每一项包括 name (来源名称, 不能重复), 可选的 url (默认为开盘啦直播接口),
+    params (追加到地址上的查询参数) 和 interval (交易时间内的轮询间隔, 单位秒)
+
+    Args:
+        config_path: 配置文件路径
+
+    Returns:
+        接口配置列表
+
+    Raises:
+        ValueError: 配置格式错误
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        feed_list = json.load(f)
+    if not isinstance(feed_list, list) or not all(isinstance(feed, dict) and feed.get("name") for feed in feed_list):
+        raise ValueError(f"{config_path} should be a list of feeds with a name")
+    return feed_list
+
+
+class FileSink:
+    """追加写入文件, 每条评论一行"""
+
+    def __init__(self, file_path: str, with_source: bool = True):
+        # 输出文件路径
+        self._file_path = file_path
+        # 每行是否带上来源
+        self._with_source = with_source
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self) -> str:
+        return self._file_path
+
+    def __call__(self, source: str, comments: List[str]) -> None:
+        now = datetime.now(MARKET_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+        prefix = f"{now} [{source}] " if self._with_source else f"{now} "
+        # 评论中可能有换行, 替换为空格保证每条评论一行
+        content = "".join(prefix + " ".join(comment.splitlines()) + "\n" for comment in comments)
+        with self._lock, open(self._file_path, 'a', encoding='utf-8') as f:
+            f.write(content)
+
+
+async def dispatch_comments(queue: asyncio.Queue, sinks: Iterable[Sink]) -> None:
+    """
+    按照顺序把队列中的新评论发送给所有输出, 普通函数在线程中执行, 不会阻塞轮询
+
+    Args:
+        queue: 元素为 (来源, 新评论列表) 的队列
+        sinks: 输出列表
+    """
+    sinks = list(sinks)
+    while True:
+        source, comments = await queue.get()
+        try:
+            for sink in sinks:
+                try:
+                    if _is_async_sink(sink):
+                        await sink(source, comments)
+                    else:
+                        await asyncio.to_thread(sink, source, comments)
+                except Exception as e:
+                    print(f"输出评论失败 {sink}: {e}")
+        finally:
+            queue.task_done()
+
+
+def _is_async_sink(sink: Sink) -> bool:
+    return inspect.iscoroutinefunction(sink) or inspect.iscoroutinefunction(getattr(sink, "__call__", None))
+
+
+class LiveFeedPoller:
+    """
+    直播评论的异步轮询
+
+    轮询间隔自适应: 交易时间使用较短的间隔, 出现新评论后立即缩短到 BURST_INTERVAL,
+    没有新评论或者请求失败时按照 BACKOFF_FACTOR 逐渐增加到最大间隔。
+    请求在线程中使用 lcn_http 的 keep-alive 连接, 新评论放入队列后由 dispatch_comments 发送给输出。
+    """
+
+    def __init__(self, feed_url: str = url, source: str = "kaipanla", seen: Any = None,
+                 timeout: float = DEFAULT_TIMEOUT, interval: Optional[float] = None):
+        # 接口地址
+        self._feed_url = feed_url
+        # 来源名称, 输出时用于区分不同的接口
+        self._source = source
+        # 已出现过的评论, 默认只在内存中去重
+        self._seen = seen if seen is not None else CommentDeduplicator()
+        # 请求超时时间
+        self._timeout = timeout
+        # 交易时间内的轮询间隔, 为 None 时使用 MARKET_INTERVAL
+        self._interval = interval
+        # 连续没有新评论或者请求失败的次数
+        self._idle_count = 0
+        # 最近一次是否有新评论
+        self._has_new = False
+
+    @property
+    def source(self) -> str:
+        return self._source
+
+    @property
+    def feed_url(self) -> str:
+        return self._feed_url
+
+    async def poll_once(self) -> List[str]:
+        """
+        请求一次接口
+
+        Returns:
+            新评论列表, 请求失败时为空列表
+        """
+        new_comments = []
+        try:
+            # 轮询本身就会重试, 不需要 lcn_http 再重试
+            response = await asyncio.to_thread(lcn_http.get, self._feed_url, timeout=self._timeout, max_retries=0)
+            response.raise_for_status()
+            data = response.json()
+            if 'List' in data:
+                new_comments = extract_new_comments(data['List'], self._seen)
+            else:
+                print(f"[{self._source}] 响应中未找到 'List' 字段")
+        except requests.exceptions.RequestException as e:
+            print(f"[{self._source}] 请求失败: {e}")
+        except ValueError:
+            print(f"[{self._source}] 响应不是有效的JSON格式")
+        except Exception as e:
+            print(f"[{self._source}] 发生错误: {e}")
+
+        self._has_new = bool(new_comments)
+        self._idle_count = 0 if new_comments else self._idle_count + 1
+        return new_comments
+
+    def next_interval(self, now: Optional[datetime] = None) -> float:
+        """
+        下一次轮询前等待的时间
+
+        Args:
+            now: 当前时间, 默认为当前时间
+
+        Returns:
+            等待时间, 单位秒
+        """
+        if self._has_new:
+            return BURST_INTERVAL
+        if is_market_time(now):
+            base_interval, max_interval = self._interval or MARKET_INTERVAL, MARKET_MAX_INTERVAL
+        else:
+            base_interval, max_interval = max(self._interval or 0, OFF_MARKET_INTERVAL), OFF_MARKET_MAX_INTERVAL
+        max_interval = max(base_interval, max_interval)
+        return min(base_interval * BACKOFF_FACTOR ** max(self._idle_count - 1, 0), max_interval)
+
+    async def poll_forever(self, queue: asyncio.Queue, stop_event: Optional[asyncio.Event] = None) -> None:
+        """
+        持续轮询, 新评论以 (来源, 新评论列表) 放入队列, stop_event 被设置后停止
+
+        Args:
+            queue: 新评论队列
+            stop_event: 停止事件
+        """
+        stop_event = stop_event or asyncio.Event()
+        while not stop_event.is_set():
+            new_comments = await self.poll_once()
+            if new_comments:
+                queue.put_nowait((self._source, new_comments))
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.next_interval())
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, sinks: Iterable[Sink] = (stdout_sink,), stop_event: Optional[asyncio.Event] = None) -> None:
+        """
+        持续轮询并把新评论发送给输出, stop_event 被设置后等待已有的评论输出完成再返回
+
+        Args:
+            sinks: 输出列表
+            stop_event: 停止事件
+        """
+        await run_pollers([self], sinks, stop_event)
+
+
+async def run_pollers(pollers: Iterable[LiveFeedPoller], sinks: Iterable[Sink] = (stdout_sink,),
+                      stop_event: Optional[asyncio.Event] = None) -> None:
+    """
+    在同一个事件循环中并发轮询多个接口, 新评论按照到达顺序放入同一个队列, 由一个 dispatch_comments 依次输出
+
+    Args:
+        pollers: 轮询列表
+        sinks: 输出列表
+        stop_event: 停止事件, 被设置后等待已有的评论输出完成再返回
+    """
+    stop_event = stop_event or asyncio.Event()
+    queue = asyncio.Queue()
+    dispatch_task = asyncio.create_task(dispatch_comments(queue, sinks))
+    try:
+        await asyncio.gather(*(poller.poll_forever(queue, stop_event) for poller in pollers))
+        await queue.join()
+    finally:
+        dispatch_task.cancel()
+
+
+class MultiFeedMonitor:
+    """
+    多个直播接口的监控, 替代每个接口一个进程
+
+    每个接口有独立的 LiveFeedPoller, 去重状态和轮询间隔互不影响, 新评论合并为一个按照到达顺序的输出,
+    输出函数通过来源参数区分接口。
+    """
+
+    def __init__(self, feed_list: List[Dict[str, Any]], seen_folder: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT):
+        """
+        Args:
+            feed_list: 接口配置列表, 格式见 load_feed_config
+            seen_folder: 去重文件目录, 为 None 时只在内存中去重
+            timeout: 请求超时时间
+        """
+        name_list = [feed["name"] for feed in feed_list]
+        duplicate_name_set = {name for name in name_list if name_list.count(name) > 1}
+        if duplicate_name_set:
+            raise ValueError(f"duplicate feed name {sorted(duplicate_name_set)}")
+        if seen_folder:
+            os.makedirs(seen_folder, exist_ok=True)
+        # 来源名称 -> 去重
+        self._seen_dict = {
+            feed["name"]: CommentDeduplicator(
+                os.path.join(seen_folder, SEEN_COMMENTS_FILE_NAME.format(source=feed["name"])) if seen_folder else None)
+            for feed in feed_list}
+        self._poller_list = [
+            LiveFeedPoller(build_feed_url(feed.get("url") or url, feed.get("params")), source=feed["name"],
+                           seen=self._seen_dict[feed["name"]], timeout=timeout, interval=feed.get("interval"))
+            for feed in feed_list]
+
+    @property
+    def poller_list(self) -> List[LiveFeedPoller]:
+        return self._poller_list
+
+    async def run(self, sinks: Iterable[Sink] = (tagged_stdout_sink,),
+                  stop_event: Optional[asyncio.Event] = None) -> None:
+        """
+        并发轮询所有接口并把新评论发送给输出
+
+        Args:
+            sinks: 输出列表
+            stop_event: 停止事件
+        """
+        await run_pollers(self._poller_list, sinks, stop_event)
+
+    def close(self) -> None:
+        """关闭所有去重文件"""
+        for seen in self._seen_dict.values():
+            seen.close()
+
+    def __enter__(self) -> 'MultiFeedMonitor':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    命令行入口, 没有配置文件时只监控默认接口
+
+    Args:
+        argv: 命令行参数, 默认为 sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(prog="python -m feature.kaipanla_zhibo_data", description="监控开盘啦直播评论")
+    parser.add_argument("-c", "--config", help="多个接口的 JSON 配置文件, 格式见 load_feed_config")
+    parser.add_argument("-s", "--seen_folder", default=".", help="去重文件目录, 默认为当前目录")
+    args = parser.parse_args(argv)
+
     print("开始监控评论更新... (Ctrl+C 停止)")
     try:
-        while True:
-            fetch_new_comments()
-            time.sleep(5)  # 每5秒检查一次更新
+        if args.config:
+            with MultiFeedMonitor(load_feed_config(args.config), args.seen_folder) as monitor:
+                asyncio.run(monitor.run())
+        else:
+            with CommentDeduplicator(os.path.join(args.seen_folder, SEEN_COMMENTS_PATH)) as persistent_seen_comments:
+                asyncio.run(LiveFeedPoller(seen=persistent_seen_comments).run([stdout_sink]))
     except KeyboardInterrupt:
-        print("\n程序已停止")
\ No newline at end of file
+        print("\n程序已停止")
+
+
+if __name__ == "__main__":
+    main()
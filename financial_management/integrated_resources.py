@@ -1,12 +1,39 @@
+import asyncio
+import contextlib
 import json
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
+from urllib.parse import urlparse
 
-import pandas as pd
-from datetime import datetime
 
-from base import lcn_time
+from base import lcn_http, lcn_markdown, lcn_time
 
-from feature.invert import fang_tang_push, zhao_shang_personal_finance, tian_tian_fund
+from feature.invert import notification_outbox, zhao_shang_personal_finance, tian_tian_fund
+
+# numpy, pandas 导入较慢, 在第一次使用时再导入
+if TYPE_CHECKING:
+    import pandas as pd
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+# 默认的并发数, 为 1 时按照配置顺序逐个请求
+DEFAULT_MAX_WORKERS = 1
+# 默认的单次请求超时时间, 单位秒
+DEFAULT_REQUEST_TIMEOUT = 10
+# 每个域名同时进行的最大请求数, 避免并发过高被数据源限流, 由 lcn_http 在每一次请求时限制, 包括分页请求
+HOST_CONCURRENCY_LIMIT = {
+    urlparse(tian_tian_fund.BASE_URL).netloc: 4,
+    urlparse(zhao_shang_personal_finance.BASE_URL).netloc: 2,
+}
+# 每个产品详情表格的列名和每列小数的格式
+ASSET_DETAIL_COLUMNS = ['日期', '净值', '金额', '盈亏', '近两日差额']
+ASSET_DETAIL_FLOAT_FORMATS = ["", "", ".2f", ".2f", ".2f"]
+# 生成报告时默认同时进行的最大请求数, 基金和理财共用
+DEFAULT_REPORT_MAX_WORKERS = 8
+# 生成报告的默认截止时间, 单位秒, 超过后推送已经获取到的部分
+DEFAULT_REPORT_DEADLINE = 120
+
+for _host, _max_concurrency in HOST_CONCURRENCY_LIMIT.items():
+    lcn_http.set_host_concurrency_limit(_host, _max_concurrency)
 
 
 class AssetOverview:
@@ -91,22 +118,20 @@ def load_json_config_from_file(file_path: str) -> Dict[str, Any]:
         return {}
 
 
-def fetch_asset_data_overview(asset_config: Dict[str, Any], is_fund: bool) -> Dict[str, Any]:
-    """获取资产数据总览
-
-    从配置中获取资产初始数据，根据配置请求对应的接口获取基金或者理财数据，并返回总览数据
+def build_asset_data_overview(fund_buy_list: List[Dict[str, Any]],
+                              result_list: List[Tuple[Optional[AssetOverview], Optional[Exception]]],
+                              section_list: Optional[List[str]] = None) -> Dict[str, Any]:
+    """汇总资产数据
 
     Args:
-        asset_config: 资产配置
-        is_fund: 是否为基金
+        fund_buy_list: 配置的产品列表
+        result_list: 和配置顺序一一对应的 (资产总览, 异常) 列表
+        section_list: 和配置顺序一一对应的已经生成的产品描述, 为 None 时在这里生成
 
     Returns:
         资产数据总览
     """
 
-    show_max_count = asset_config.get("show_max_count", 0)
-    fund_buy_list = asset_config.get("buy_list", [])
-
     all_asset_overview = {
         "initial_amount": 0.0,
         "current_amount": 0.0,
@@ -115,25 +140,55 @@ def fetch_asset_data_overview(asset_config: Dict[str, Any], is_fund: bool) -> Di
         "overview_str": ""
     }
 
-    for config_personal_finance_data in fund_buy_list:
-        # 加 1, 为了计算每日的差值, 所以需要比需要的行数多请求 1 条数据
-        one_asset_overview = handle_one_asset_data(config_personal_finance_data, show_max_count + 1, is_fund)
+    if section_list is None:
+        section_list = [change_one_asset_result_to_string(config_data, one_asset_overview, error)
+                        for config_data, (one_asset_overview, error) in zip(fund_buy_list, result_list)]
+
+    for one_asset_overview, error in result_list:
+        if error is not None:
+            continue
         all_asset_overview["initial_amount"] += one_asset_overview.initial_amount
         all_asset_overview["current_amount"] += one_asset_overview.current_amount
         all_asset_overview["profit_loss_situation"] += one_asset_overview.profit_loss_situation()
         all_asset_overview["preview_day_diff_amount"] += one_asset_overview.preview_day_diff_amount
-        all_asset_overview["overview_str"] += change_one_asset_overview_to_string(one_asset_overview)
+    all_asset_overview["overview_str"] = "".join(section_list)
 
     return all_asset_overview
 
 
-def handle_one_asset_data(config_data: dict[str, str], request_count: int, is_fund: bool) -> AssetOverview:
+def fetch_one_asset_data(config_data: dict[str, str], request_count: int, is_fund: bool,
+                         request_timeout: float = DEFAULT_REQUEST_TIMEOUT, nav_store_path: Optional[str] = None
+                         ) -> Tuple[Optional[AssetOverview], Optional[Exception]]:
+    """获取一个资产的数据, 失败时不抛出异常
+
+    Args:
+        config_data: 配置的数据
+        request_count: 请求的天数
+        is_fund: 是否为基金
+        request_timeout: 单次请求超时时间, 单位秒
+        nav_store_path: 基金本地净值存储的文件路径, 为 None 时不使用本地存储
+
+    Returns:
+        (资产总览, None), 失败时为 (None, 异常)
+    """
+    try:
+        return handle_one_asset_data(config_data, request_count, is_fund, request_timeout, nav_store_path), None
+    except Exception as e:  # 单个产品失败不影响其他产品
+        print(f"获取 {config_data.get('name')}({config_data.get('code')}) 数据失败: {e}")
+        return None, e
+
+
+def handle_one_asset_data(config_data: dict[str, str], request_count: int, is_fund: bool,
+                          request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                          nav_store_path: Optional[str] = None) -> AssetOverview:
     """处理一个资产的数据
 
     Args:
         config_data: 配置的数据
         request_count:  请求的天数
         is_fund: 是否为基金
+        request_timeout: 单次请求超时时间, 单位秒
+        nav_store_path: 基金本地净值存储的文件路径, 为 None 时不使用本地存储
 
     Returns:
         资产数据总览
@@ -147,11 +202,42 @@ def handle_one_asset_data(config_data: dict[str, str], request_count: int, is_fu
 
         # 请求天天基金获取对应的基金情况
         asset_response_list = tian_tian_fund.fetch_fund_data(config_data["code"], request_count, request_start_day,
-                                                             request_end_day)
+                                                             request_end_day, request_timeout,
+                                                             nav_store_path)
     else:
         # 请求招商理财获取对应的理财情况
         asset_response_list = zhao_shang_personal_finance.fetch_personal_finance_data(config_data["code"],
-                                                                                      request_count)
+                                                                                      request_count,
+                                                                                      request_timeout)
+
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+    if not asset_response_list:
+        raise RuntimeError("未获取到数据")
+    if not isinstance(asset_response_list, AssetNetworkSeries):
+        asset_response_list = AssetNetworkSeries.from_responses(asset_response_list)
+    return build_asset_overview(config_data, asset_response_list, request_count)
+
+
+def build_asset_overview(config_data: dict[str, str], asset_response_list: "AssetNetworkSeries",
+                         request_count: int) -> AssetOverview:
+    """根据净值序列计算一个资产的金额、盈亏和每日差额
+
+    Args:
+        config_data: 配置的数据
+        asset_response_list: 按照日期倒序的净值序列
+        request_count: 请求的天数, 最后一条只用来计算前一天的差额
+
+    Returns:
+        资产数据总览
+
+    Raises:
+        RuntimeError: 净值少于 2 条, 无法计算当前金额和前一天的差额
+    """
+
+    # 至少需要当天和前一天的净值, 否则当前金额为 0, 盈亏会变成整个投入金额
+    if len(asset_response_list) < min(request_count, 2):
+        raise RuntimeError(f"净值数据只有 {len(asset_response_list)} 条, 至少需要 2 条")
 
     # 持有份额
     available_shares = config_data["available_shares"]
@@ -168,34 +254,70 @@ def handle_one_asset_data(config_data: dict[str, str], request_count: int, is_fu
         date_detail_list=[]
     )
 
-    for index, asset_response in enumerate(asset_response_list):
-
-        # 最后一行不处理, 只是用来计算上一次的差值
-        if index + 1 == request_count:
-            break
-
-        # 当天的金额 = 持有的份额 * 当天的净值, 保留 2 为小数
-        current_money = available_shares * asset_response.net_asset_value
-
-        next_item = asset_response_list[index + 1]
-        # 每个基金的盈利情况，只需要根据第一个的数据计算即可
-        if index == 0:
-            asset_overview.current_amount = current_money
-            asset_overview.preview_day_diff_amount = (
-                    available_shares * (asset_response.net_asset_value - next_item.net_asset_value))
-
-        # 填充信息 日期 单位净值 当前金额 当天盈利情况
-        asset_overview.date_detail_list.append([
-            # 将字符串格式为 yy-mm-dd
-            format_date_to_short(asset_response.date),
-            asset_response.net_asset_value,
-            current_money,
-            current_money - initial_amount,
-            available_shares * (asset_response.net_asset_value - next_item.net_asset_value)
-        ])
+    # 最后一行不处理, 只是用来计算上一次的差值
+    row_count = min(request_count, len(asset_response_list)) - 1
+    if row_count <= 0:
+        return asset_overview
+
+    net_asset_value_array = asset_response_list.net_asset_values[:row_count + 1]
+    # 当天的金额 = 持有的份额 * 当天的净值
+    current_money_array = available_shares * net_asset_value_array[:-1]
+    # 当天的盈亏 = 持有的份额 * (当天的净值 - 前一天的净值), 接口返回的数据按照日期倒序
+    day_diff_array = available_shares * (net_asset_value_array[:-1] - net_asset_value_array[1:])
+    profit_loss_array = current_money_array - initial_amount
+
+    # 每个基金的盈利情况，只需要根据第一个的数据计算即可
+    asset_overview.current_amount = current_money_array[0].item()
+    asset_overview.preview_day_diff_amount = day_diff_array[0].item()
+
+    # 填充信息 日期 单位净值 当前金额 当天盈利情况
+    asset_overview.date_detail_list.extend(
+        [list(row) for row in zip(
+            # 将字符串格式为 yy-mm-dd, 即 yyyy-mm-dd 去掉年份的前两位
+            [date[2:] for date in asset_response_list[:row_count].date_strings()],
+            net_asset_value_array[:-1].tolist(),
+            current_money_array.tolist(),
+            profit_loss_array.tolist(),
+            day_diff_array.tolist()
+        )]
+    )
     return asset_overview
 
 
+def calculate_asset_matrix(asset_response_dict: Dict[str, "AssetNetworkSeries"],
+                           available_shares_dict: Dict[str, float],
+                           initial_amount_dict: Dict[str, float]) -> Dict[str, "pd.DataFrame"]:
+    """一次计算所有产品的金额、盈亏和每日差额
+
+    所有产品的净值按照日期对齐为一个 日期 x 产品 的矩阵, 整体做向量运算。
+    不同产品的交易日不同, 没有净值的日期为 NaN, 每日差额和该产品前一个有净值的日期比较。
+
+    Args:
+        asset_response_dict: 产品代码 -> 净值序列
+        available_shares_dict: 产品代码 -> 持有份额
+        initial_amount_dict: 产品代码 -> 投入金额
+
+    Returns:
+        net_asset_value(净值), amount(金额), profit_loss(盈亏), day_diff(每日差额) 四个矩阵,
+        行为按照日期倒序的 DatetimeIndex, 列为产品代码
+    """
+    import numpy as np
+    import pandas as pd
+
+    net_asset_value_df = pd.DataFrame({
+        code: asset_series.to_pandas() for code, asset_series in asset_response_dict.items()
+    }).sort_index(ascending=False)
+
+    amount_df = net_asset_value_df * pd.Series(available_shares_dict, dtype=np.float64)
+    return {
+        "net_asset_value": net_asset_value_df,
+        "amount": amount_df,
+        "profit_loss": amount_df - pd.Series(initial_amount_dict, dtype=np.float64),
+        # 倒序排列, 下面第一个有值的行即为前一个交易日
+        "day_diff": amount_df - amount_df.shift(-1).bfill(),
+    }
+
+
 def change_one_asset_overview_to_string(asset_overview: AssetOverview) -> str:
     """
     将资产的总览转为一个字符串
@@ -215,13 +337,40 @@ def change_one_asset_overview_to_string(asset_overview: AssetOverview) -> str:
         f"近两日差额: {format_money(asset_overview.preview_day_diff_amount)} \n\n"
     )
 
-    asset_result_pd = pd.DataFrame(
-        asset_overview.date_detail_list,
-        columns=['日期', '净值', '金额', '盈亏', '近两日差额']
-    )
+    # 指定各列保留的小数位, 输出和 pandas 的 to_markdown 一致
+    asset_result_table = lcn_markdown.render_pipe_table(
+        ASSET_DETAIL_COLUMNS, asset_overview.date_detail_list, ASSET_DETAIL_FLOAT_FORMATS)
+    return "".join((overview_title, asset_result_table, "\n\n"))
+
+
+def change_one_asset_result_to_string(config_data: dict[str, str], asset_overview: Optional[AssetOverview],
+                                      error: Optional[Exception]) -> str:
+    """
+    将一个资产的获取结果转为一个字符串
+    Args:
+        config_data: 配置的数据
+        asset_overview: 资产的总览, 失败时为 None
+        error: 失败的异常, 成功时为 None
+
+    Returns:
+        资产的总览字符串或者失败提示字符串
+    """
+    if error is not None:
+        return change_failed_asset_to_string(config_data, error)
+    return change_one_asset_overview_to_string(asset_overview)
+
 
-    # 指定各列保留的小数位
-    return overview_title + asset_result_pd.to_markdown(index=False, floatfmt=["", "", ".2f", ".2f", ".2f"]) + "\n\n"
+def change_failed_asset_to_string(config_data: dict[str, str], error: Exception) -> str:
+    """
+    将获取失败的资产转为一个字符串
+    Args:
+        config_data: 配置的数据
+        error: 失败的异常
+
+    Returns:
+        失败提示字符串
+    """
+    return f"产品: {config_data.get('name')}({config_data.get('code')})\n\n获取数据失败: {error}\n\n"
 
 
 def create_fang_tang_desc(fund_data_overview: dict[str, Any], personal_finance_data_overview: dict[str, Any]) -> str:
@@ -243,9 +392,9 @@ def create_fang_tang_desc(fund_data_overview: dict[str, Any], personal_finance_d
             f"近两日差额: {preview_day_diff_amount_total}\n\n"
             f"\n\n")
 
-    desc += build_asset_all_overview("基金", fund_data_overview)
-    desc += build_asset_all_overview("理财", personal_finance_data_overview)
-    return desc
+    return "".join((desc,
+                    build_asset_all_overview("基金", fund_data_overview),
+                    build_asset_all_overview("理财", personal_finance_data_overview)))
 
 
 def build_asset_all_overview(product_type, asset_overview):
@@ -266,41 +415,152 @@ def build_asset_all_overview(product_type, asset_overview):
     )
 
 
-def format_date_to_short(date_str: str) -> str:
+def format_money(money):
+    if money is None:
+        return 0.0
+    return round(money, 2)
+
+
+async def fetch_one_asset_section(executor: ThreadPoolExecutor, config_data: dict[str, str], request_count: int,
+                                  is_fund: bool, request_timeout: float, nav_store_path: Optional[str],
+                                  semaphore: Optional[asyncio.Semaphore] = None
+                                  ) -> Tuple[Optional[AssetOverview], Optional[Exception], str]:
+    """获取一个资产的数据, 获取到后立即生成描述
+
+    Args:
+        executor: 执行同步请求的线程池
+        config_data: 配置的数据
+        request_count: 请求的天数
+        is_fund: 是否为基金
+        request_timeout: 单次请求超时时间, 单位秒
+        nav_store_path: 基金本地净值存储的文件路径, 为 None 时不使用本地存储
+        semaphore: 限制同一部分同时获取的产品数, 为 None 时不限制
+
+    Returns:
+        (资产总览, 异常, 描述字符串)
     """
-    将日期字符串从 'yyyy-mm-dd' 格式转换为 'yy-mm-dd' 格式
+    loop = asyncio.get_running_loop()
+    async with semaphore if semaphore is not None else contextlib.nullcontext():
+        one_asset_overview, error = await loop.run_in_executor(executor, fetch_one_asset_data, config_data,
+                                                               request_count, is_fund, request_timeout, nav_store_path)
+    return one_asset_overview, error, change_one_asset_result_to_string(config_data, one_asset_overview, error)
+
+
+async def fetch_asset_overview_list_async(asset_config_list: List[Tuple[Dict[str, Any], bool]], max_workers: int,
+                                          deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+    """在一个事件循环中同时获取多个部分的资产数据, 返回每个部分的总览
+
+    所有部分共用一个大小为 max_workers 的线程池, 每个部分配置了 max_workers 时,
+    该部分同时获取的产品数不超过这个值。每个数据源的并发数由 HOST_CONCURRENCY_LIMIT 限制。
 
     Args:
-        yyyy-mm-dd 格式的字符串
+        asset_config_list: (资产配置, 是否为基金) 的列表
+        max_workers: 线程池的大小
+        deadline: 截止时间, 单位秒, 超过后还没有获取到的产品按照失败处理, 为 None 时等待全部完成
 
     Returns:
-        yy-mm-dd 格式的字符串
+        和 asset_config_list 顺序一一对应的资产数据总览
     """
-    date_obj = datetime.strptime(date_str, "%Y-%m-%d")  # Parse to datetime object
-    return date_obj.strftime("%y-%m-%d")  # Format to 'yy-mm-dd'
 
+    # 每部分的配置和产品的任务列表
+    part_list = []
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for asset_config, is_fund in asset_config_list:
+            # 加 1, 为了计算每日的差值, 所以需要比需要的行数多请求 1 条数据
+            request_count = asset_config.get("show_max_count", 0) + 1
+            request_timeout = asset_config.get("request_timeout", DEFAULT_REQUEST_TIMEOUT)
+            nav_store_path = asset_config.get("nav_store_path")
+            fund_buy_list = asset_config.get("buy_list", [])
+            section_max_workers = asset_config.get("max_workers")
+            semaphore = asyncio.Semaphore(section_max_workers) if section_max_workers else None
+            task_list = [asyncio.create_task(fetch_one_asset_section(executor, config_data, request_count, is_fund,
+                                                                     request_timeout, nav_store_path, semaphore))
+                         for config_data in fund_buy_list]
+            part_list.append((fund_buy_list, task_list))
+
+        all_task_list = [task for _, task_list in part_list for task in task_list]
+        if all_task_list:
+            _, pending_set = await asyncio.wait(all_task_list, timeout=deadline)
+            for task in pending_set:
+                task.cancel()
+    finally:
+        # 超时的请求无法中断, 不再等待它们结束
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    overview_list = []
+    for fund_buy_list, task_list in part_list:
+        result_list = []
+        section_list = []
+        for config_data, task in zip(fund_buy_list, task_list):
+            if not task.done():
+                error = TimeoutError(f"超过截止时间 {deadline} 秒")
+                print(f"获取 {config_data.get('name')}({config_data.get('code')}) 数据失败: {error}")
+                result_list.append((None, error))
+                section_list.append(change_failed_asset_to_string(config_data, error))
+            else:
+                one_asset_overview, error, section = task.result()
+                result_list.append((one_asset_overview, error))
+                section_list.append(section)
+        overview_list.append(build_asset_data_overview(fund_buy_list, result_list, section_list))
+    return overview_list
 
-def format_money(money):
-    if money is None:
-        return 0.0
-    return round(money, 2)
 
+def fetch_asset_data_overview(asset_config: Dict[str, Any], is_fund: bool) -> Dict[str, Any]:
+    """获取资产数据总览
+
+    从配置中获取资产初始数据，根据配置请求对应的接口获取基金或者理财数据，并返回总览数据。
+    配置中的 max_workers 大于 1 时并发请求各个产品, 单个产品失败只会在总览中提示, 不会中断整体流程,
+    汇总顺序始终与配置顺序一致。基金配置了 nav_store_path 时, 净值会增量同步到本地后从本地读取。
+
+    Args:
+        asset_config: 资产配置
+        is_fund: 是否为基金
+
+    Returns:
+        资产数据总览
+    """
+    max_workers = asset_config.get("max_workers", DEFAULT_MAX_WORKERS)
+    return asyncio.run(fetch_asset_overview_list_async([(asset_config, is_fund)], max_workers))[0]
 
-def start_handle(config_file_path: str):
-    # 获取配置
-    json_config_data = load_json_config_from_file(config_file_path)
 
-    # 基金情况
-    current_fund_data_overview = fetch_asset_data_overview(json_config_data["fund"], True)
+async def create_fang_tang_desc_async(json_config_data: Dict[str, Any]) -> str:
+    """在一个事件循环中同时获取所有基金和理财的数据, 生成推送的描述
 
-    # 理财情况
-    current_personal_finance_data_overview = fetch_asset_data_overview(json_config_data["personal_finance"], False)
+    超过配置的 report_deadline 秒还没有获取到的产品按照失败处理, 只推送已经获取到的部分。
+    基金和理财共用一个线程池, 大小为顶层配置的 max_workers, 默认为 DEFAULT_REPORT_MAX_WORKERS,
+    基金和理财配置中的 max_workers 限制各自同时获取的产品数。
 
-    # 推送方糖的描述
-    send_desc = create_fang_tang_desc(current_fund_data_overview, current_personal_finance_data_overview)
+    Args:
+        json_config_data: 完整的配置
+
+    Returns:
+        推送的描述
+    """
+    max_workers = json_config_data.get("max_workers", DEFAULT_REPORT_MAX_WORKERS)
+    deadline = json_config_data.get("report_deadline", DEFAULT_REPORT_DEADLINE)
+
+    fund_data_overview, personal_finance_data_overview = await fetch_asset_overview_list_async(
+        [(json_config_data["fund"], True), (json_config_data["personal_finance"], False)], max_workers, deadline)
+    return create_fang_tang_desc(fund_data_overview, personal_finance_data_overview)
+
+
+async def start_handle_async(config_file_path: str):
+    # 获取配置
+    json_config_data = load_json_config_from_file(config_file_path)
+
+    # 推送方糖的描述, 基金和理财同时获取
+    send_desc = await create_fang_tang_desc_async(json_config_data)
     print("推送内容: " + send_desc)
-    # 推送方糖
+    # 推送方糖, 加入发件箱后立即返回, 由后台线程推送和重试
     fang_tang_config = json_config_data["fang_tang"]
     send_title = f"{lcn_time.today()} 收益通知\n\n"
-    fang_tang_push.sc_send(fang_tang_config["send_key"], send_title, send_desc)
-    print("推送成功")
+    outbox = notification_outbox.NotificationOutbox(
+        fang_tang_config.get("outbox_path", notification_outbox.DEFAULT_OUTBOX_PATH),
+        fang_tang_config.get("daily_quota", notification_outbox.DEFAULT_DAILY_QUOTA))
+    outbox.enqueue(fang_tang_config["send_key"], send_title, send_desc)
+    print("已加入推送队列")
+
+
+def start_handle(config_file_path: str):
+    asyncio.run(start_handle_async(config_file_path))
@@ -1,24 +1,43 @@
+import argparse
+import os
+import re
+import subprocess
 import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 import base.lcn_file as lcn_file
 import financial_management.integrated_resources as integrated_resources
+from feature.invert import tian_tian_fund, zhao_shang_personal_finance
 
+# requests 导入较慢, 只在测试中使用
+if TYPE_CHECKING:
+    import requests
 
-def get_file_path_from_argv(arg_name: str, default_value: str) -> str:
-    """
-    获取文件路径
+# 默认的理财配置文件
+DEFAULT_CONFIG_FILE_PATH = "my_python_config.json"
+# 导入 function_test 的耗时上限, 单位毫秒
+IMPORT_TIME_BUDGET_MS = 150
+# 启动时不应该导入的慢模块, 只在第一次使用时导入
+LAZY_MODULE_LIST = ["pandas", "numpy", "lxml", "bs4", "chardet", "requests"]
+# 测试数据目录, 保存接口响应和页面
+TEST_DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
 
-    从命令行参数中获取文件路径，如果没有则返回默认路径
 
-    Returns
-        文件路径
+def read_test_data(file_name: str) -> str:
     """
+    读取测试数据, 按照字节读取后解码, 保留页面中原始的换行符, 和 requests 的 response.text 一致
+
+    Args:
+        file_name: 测试数据目录下的文件名
 
-    # 第一个参数为脚本的名称
-    for index in range(1, len(sys.argv)):
-        if sys.argv[index] == arg_name:
-            return sys.argv[index + 1]
-    return default_value
+    Returns:
+        文件内容
+    """
+    with open(os.path.join(TEST_DATA_FOLDER, file_name), 'rb') as f:
+        return f.read().decode('utf-8')
 
 
 def test_convert_file_encoding():
@@ -28,19 +47,242 @@ def test_convert_file_encoding():
     print(new_file_path)
 
 
-def test_financial_management():
-    config_file_path = "my_python_config.json"
-    arg_name = "--lcn_file"
+def test_convert_file_encoding_benchmark(size_mb_list=(16, 256)):
+    # 生成 GBK 编码的大文件, 测试检测和转换编码的吞吐量和内存峰值
+    line = "2024-01-01,基金净值导出,测试数据 ABC,1.2345,喆镕\r\n".encode("gbk")
+    # 提前导入 chardet, 不计入检测耗时
+    import chardet.universaldetector  # noqa: F401
+    with tempfile.TemporaryDirectory() as folder:
+        for size_mb in size_mb_list:
+            file_path = os.path.join(folder, f"export_{size_mb}mb.csv")
+            with open(file_path, 'wb') as f:
+                block = line * (1024 * 1024 // len(line))
+                for _ in range(size_mb):
+                    f.write(block)
+            file_size = os.path.getsize(file_path)
+
+            tracemalloc.start()
+            cost = timeit.timeit(lambda: lcn_file.detect_encoding(file_path), number=1)
+            detect_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            cost_convert = timeit.timeit(lambda: lcn_file.convert_file_encoding(file_path, "utf-8"), number=1)
+            convert_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print(f"{file_size / 1024 / 1024:.0f} MB, 检测 {cost * 1000:.1f} ms, 峰值 {detect_peak / 1024:.0f} KB; "
+                  f"转换 {file_size / 1024 / 1024 / cost_convert:.1f} MB/s, 峰值 {convert_peak / 1024 / 1024:.1f} MB")
+
+
+def test_parse_personal_finance_benchmark():
+    # 招商理财产品净值页面, 一页 10 条数据
+    html = read_test_data("cmb_prodvalue.html")
+    assert len(zhao_shang_personal_finance.parse_personal_finance_html(html)) == \
+        zhao_shang_personal_finance.PAGE_SIZE
+
+    number = 100
+    cost = timeit.timeit(lambda: zhao_shang_personal_finance.parse_personal_finance_html(html), number=number)
+    print(f"解析 {number} 次, 平均每页 {cost / number * 1000:.3f} ms")
+
+
+def build_test_response(file_name: str) -> "requests.Response":
+    """
+    用测试数据构造接口响应
+
+    Args:
+        file_name: 测试数据目录下的文件名
+
+    Returns:
+        requests.Response 对象
+    """
+    import requests
+
+    response = requests.Response()
+    response.status_code = 200
+    response._content = read_test_data(file_name).encode('utf-8')
+    response.encoding = 'utf-8'
+    return response
+
+
+def parse_fund_data_by_bs4(html_response: "requests.Response") -> List[Tuple[str, float]]:
+    # 改用 lxml 之前的解析方式, 作为对照
+    from bs4 import BeautifulSoup
+
+    row_list = []
+    for row in BeautifulSoup(html_response.text, 'html.parser').find_all("tr")[1:]:
+        try:
+            columns = row.find_all("td")
+            if len(columns) < 2:
+                continue
+            row_list.append((columns[0].text.strip(), float(columns[1].text.strip())))
+        except (IndexError, ValueError):
+            pass
+    return row_list
+
+
+def test_parse_fund_data_equivalence():
+    # 完整的一页, 没有数据, 以及响应被截断并且有缺少净值、日期错误和列不足的行
+    # lxml 解析时校验日期, 日期错误的行和净值错误的行一样跳过, bs4 保留原始的日期字符串, 是唯一的差异
+    for file_name, bs4_count, expected_count in (("lsjz_full.txt", tian_tian_fund.MAX_PAGE_SIZE,
+                                                  tian_tian_fund.MAX_PAGE_SIZE),
+                                                 ("lsjz_empty.txt", 0, 0), ("lsjz_malformed.txt", 5, 4)):
+        response = build_test_response(file_name)
+        bs4_row_list = parse_fund_data_by_bs4(response)
+        assert len(bs4_row_list) == bs4_count, f"{file_name}: bs4 解析到 {len(bs4_row_list)} 条, 应该为 {bs4_count} 条"
+        expected_row_list = [row for row in bs4_row_list if re.fullmatch(r"\d{4}-\d{2}-\d{2}", row[0])]
+
+        series = tian_tian_fund.parse_fund_data_from_html_response(response)
+        row_list = list(zip(series.date_strings(), series.net_asset_values.tolist()))
+        for index, (expected_row, row) in enumerate(zip(expected_row_list, row_list)):
+            assert expected_row == row, f"{file_name} 第 {index} 行不一致: {expected_row} != {row}"
+        assert len(row_list) == len(expected_row_list) == expected_count, \
+            f"{file_name}: bs4 解析到 {len(expected_row_list)} 条有效数据, lxml 解析到 {len(row_list)} 条"
+        print(f"{file_name}: {len(row_list)} 条数据一致")
+
+
+def test_parse_fund_data_benchmark():
+    # 东方财富 lsjz 接口一页的响应
+    response = build_test_response("lsjz_full.txt")
+
+    number = 1000
+    cost = timeit.timeit(lambda: tian_tian_fund.parse_fund_data_from_html_response(response), number=number)
+    print(f"解析 {number} 次, 平均每次 {cost / number * 1000:.3f} ms, "
+          f"每次 {len(tian_tian_fund.parse_fund_data_from_html_response(response))} 条数据")
+
+
+def test_render_asset_overview_benchmark():
+    import pandas as pd
+
+    def render_by_pandas(asset_overview):
+        return pd.DataFrame(asset_overview.date_detail_list, columns=integrated_resources.ASSET_DETAIL_COLUMNS) \
+            .to_markdown(index=False, floatfmt=integrated_resources.ASSET_DETAIL_FLOAT_FORMATS)
 
-    config_file_path = get_file_path_from_argv(arg_name, config_file_path)
+    def render_by_table(asset_overview):
+        return integrated_resources.lcn_markdown.render_pipe_table(
+            integrated_resources.ASSET_DETAIL_COLUMNS, asset_overview.date_detail_list,
+            integrated_resources.ASSET_DETAIL_FLOAT_FORMATS)
 
+    for product_count in (10, 100, 1000):
+        asset_overview_list = [
+            integrated_resources.AssetOverview(
+                code=f"{index:06d}", name=f"产品{index}", initial_amount=10000.0, available_shares=8000.0,
+                current_amount=0.0, preview_day_diff_amount=0.0,
+                date_detail_list=[[f"24-01-{day:02d}", 1.2345 + day / 1000, 9876.543 + day, -123.456 + day,
+                                   day * 0.5 - 3] for day in range(1, 11)])
+            for index in range(product_count)
+        ]
+        for render in (render_by_pandas, render_by_table):
+            cost = timeit.timeit(lambda: "".join(map(render, asset_overview_list)), number=1)
+            print(f"{product_count} 个产品, {render.__name__}: {cost * 1000:.1f} ms")
+        assert list(map(render_by_pandas, asset_overview_list)) == list(map(render_by_table, asset_overview_list))
+
+
+def test_asset_matrix_equivalence(request_count: int = 8):
+    # 两个产品的交易日不同, 矩阵中没有净值的日期为 NaN, 每日差额需要和该产品前一个有净值的日期比较
+    import numpy as np
+    from base.clazz.asset_network_series import AssetNetworkSeries
+
+    date_list = [f"2024-06-{day:02d}" for day in range(30, 0, -1)]
+    asset_response_dict = {
+        "005905": AssetNetworkSeries([date for index, date in enumerate(date_list) if index % 7 not in (1, 2)],
+                                     [1.5 + index * 0.0123 for index in range(len(date_list))
+                                      if index % 7 not in (1, 2)]),
+        "107108": AssetNetworkSeries([date for index, date in enumerate(date_list) if index % 5 != 3],
+                                     [1.05 - index * 0.0007 for index in range(len(date_list)) if index % 5 != 3]),
+    }
+    config_dict = {
+        "005905": {"code": "005905", "name": "基金", "available_shares": 8123.45, "initial_amount": 10000.0},
+        "107108": {"code": "107108", "name": "理财", "available_shares": 50000.0, "initial_amount": 52000.0},
+    }
+
+    matrix_dict = integrated_resources.calculate_asset_matrix(
+        asset_response_dict, {code: config["available_shares"] for code, config in config_dict.items()},
+        {code: config["initial_amount"] for code, config in config_dict.items()})
+    for code, asset_response_list in asset_response_dict.items():
+        asset_overview = integrated_resources.build_asset_overview(config_dict[code], asset_response_list,
+                                                                   request_count)
+        assert len(asset_overview.date_detail_list) == request_count - 1
+        for short_date, net_asset_value, amount, profit_loss, day_diff in asset_overview.date_detail_list:
+            date = np.datetime64("20" + short_date)
+            expected_row = [matrix_dict[name].at[date, code]
+                            for name in ("net_asset_value", "amount", "profit_loss", "day_diff")]
+            assert np.allclose([net_asset_value, amount, profit_loss, day_diff], expected_row), \
+                f"{code} {short_date}: {[net_asset_value, amount, profit_loss, day_diff]} != {expected_row}"
+        print(f"{code}: {len(asset_overview.date_detail_list)} 天的数据一致")
+
+    # 只有一条净值时无法计算差额, 需要失败而不是返回金额为 0 的总览
+    one_row_list = AssetNetworkSeries(["2024-06-30"], [1.5])
+    try:
+        integrated_resources.build_asset_overview(config_dict["005905"], one_row_list, request_count)
+    except RuntimeError as e:
+        print(f"只有一条净值时失败: {e}")
+    else:
+        raise AssertionError("只有一条净值时没有失败")
+
+
+def test_import_time_budget():
+    # 用新的解释器导入, 避免当前进程已经导入的模块影响结果
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import function_test"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+
+    # 每行格式为 import time: self [us] | cumulative | imported package
+    cumulative_dict = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)", line)
+        if match:
+            cumulative_dict[match.group(2)] = int(match.group(1))
+
+    cost_ms = cumulative_dict["function_test"] / 1000
+    print(f"导入 function_test 耗时 {cost_ms:.1f} ms, 上限 {IMPORT_TIME_BUDGET_MS} ms")
+    assert cost_ms <= IMPORT_TIME_BUDGET_MS, f"导入耗时 {cost_ms:.1f} ms 超过上限 {IMPORT_TIME_BUDGET_MS} ms"
+
+    eager_module_list = [module for module in LAZY_MODULE_LIST if module in cumulative_dict]
+    assert not eager_module_list, f"启动时导入了 {eager_module_list}"
+
+
+def test_financial_management(config_file_path: str = DEFAULT_CONFIG_FILE_PATH):
     # 理财管理
     integrated_resources.start_handle(config_file_path)
 
 
+def main(argv: Optional[List[str]] = None):
+    """
+    命令行入口, 生成理财日报并推送
+
+    Args:
+        argv: 命令行参数, 默认为 sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(description="理财管理日报")
+    parser.add_argument("--lcn_file", dest="config_file_path", default=DEFAULT_CONFIG_FILE_PATH,
+                        help=f"理财配置文件路径, 默认为 {DEFAULT_CONFIG_FILE_PATH}")
+    args = parser.parse_args(argv)
+
+    # 测试理财管理
+    test_financial_management(args.config_file_path)
+
+
 if __name__ == '__main__':
     # 测试转换文件编码
     # test_convert_file_encoding()
 
-    # 测试理财管理
-    test_financial_management()
+    # 测试大文件转换编码的吞吐量
+    # test_convert_file_encoding_benchmark()
+
+    # 测试招商理财页面解析耗时
+    # test_parse_personal_finance_benchmark()
+
+    # 测试东方财富净值解析和改用 lxml 之前的结果一致
+    # test_parse_fund_data_equivalence()
+
+    # 测试东方财富净值解析耗时
+    # test_parse_fund_data_benchmark()
+
+    # 测试生成报告表格耗时
+    # test_render_asset_overview_benchmark()
+
+    # 测试向量化的资产矩阵和逐个产品的计算结果一致
+    # test_asset_matrix_equivalence()
+
+    # 测试启动导入耗时
+    # test_import_time_budget()
+
+    main()